@@ -0,0 +1,226 @@
+"""
+Benchmark of thesis_common.learning_pipeline.curve_calculations on synthetic occupancy curves.
+
+For every size and every CurveDiffEngine it times get_intersections(), get_polygons() and
+get_relative_difference(), records the peak memory of each call (tracemalloc) and writes the results as json,
+so that runs of different revisions can be compared. The script imports its own checkout of thesis_common, so the
+older revision is benchmarked from a worktree. Both revisions must be 0.3.0 or newer - 0.2.1 has no Curve,
+CurveDiffRunner or CurveDiffEngine:
+
+    git worktree add ../baseline <older revision>
+    python ../baseline/benchmarks/curve_calculations_benchmark.py --label <older revision> --output baseline.json
+    python benchmarks/curve_calculations_benchmark.py --label HEAD --output head.json --compare baseline.json
+
+get_intersections() and get_polygons() don't depend on the engine - they are timed once, with the polygon engine.
+The polygon engine is slow on big curves, so it only runs up to --max-polygon-size points.
+
+With --runner-workers the throughput of CurveDiffRunner (jobs per second) is measured as well, once for each of the
+given numbers of worker processes:
+
+    python benchmarks/curve_calculations_benchmark.py --sizes 10080 --runner-workers 1 2 4 8
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from os import path
+
+import numpy as np
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+from thesis_common.learning_pipeline.curve_calculations import CurveDiffCalculator, curve_to_points
+from thesis_common.learning_pipeline.curve_arrays import Curve
+from thesis_common.learning_pipeline.curve_diff_runner import CurveDiffRunner
+from thesis_common.learning_pipeline.enums import CurveDiffEngine
+
+seconds_in_day = 24 * 60 * 60
+default_sizes = [10 ** 2, 10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6]
+
+
+def occupancy_curve(n, days=1, capacity=500, noise=0.05, start=1483225200, seed=0):
+    """
+    A synthetic occupancy curve of a venue: empty at night, busy during the day, with noise.
+    :param n: number of points
+    :param days: how many days the curve spans
+    :param capacity: the max number of people
+    :param noise: standard deviation of the noise, relative to :capacity
+    :param start: epoch seconds of the first point
+    :return: Curve
+    """
+    rng = np.random.RandomState(seed)
+    x = start + np.linspace(0, days * seconds_in_day, n)
+    time_of_day = (x - start) % seconds_in_day / seconds_in_day
+    # open between 07:00 and 23:00, busiest in the afternoon
+    opening_hours = np.clip((time_of_day - 7 / 24.0) / (16 / 24.0), 0, 1)
+    busy = np.sin(np.pi * opening_hours) ** 2
+    y = capacity * busy + rng.normal(0, noise * capacity, n) * (busy > 0)
+    return Curve(x, np.clip(y, 0, capacity))
+
+
+def prediction_curve(reference, crossings, error=0.2, capacity=500, seed=1):
+    """
+    A synthetic prediction for :reference, which crosses it roughly :crossings times.
+    The prediction is sampled half-way between the points of the reference, so the two curves have different grids.
+    :param reference: Curve
+    :param crossings: how often the prediction should cross the reference
+    :param error: amplitude of the prediction error, relative to :capacity
+    :return: Curve
+    """
+    rng = np.random.RandomState(seed)
+    x = reference.x[:-1] + np.diff(reference.x) / 2.0
+    progress = (x - reference.x[0]) / (reference.x[-1] - reference.x[0])
+    # tanh() makes the error switch sign quickly, so the noise of the reference doesn't add crossings
+    y = np.interp(x, reference.x, reference.y) + error * capacity * np.tanh(
+        20 * np.sin(np.pi * crossings * progress + 0.5))
+    y += rng.normal(0, 0.001 * capacity, x.size)
+    return Curve(np.concatenate(([reference.x[0]], x, [reference.x[-1]])),
+                 np.concatenate(([reference.y[0]], y, [reference.y[-1]])))
+
+
+def scenarios(sizes):
+    """
+    :return: generator of (name, size, curve1, curve2) tuples
+    """
+    for size in sizes:
+        reference = occupancy_curve(size, days=max(1, size // (24 * 60)))
+        for name, crossings in [('few_crossings', 4), ('many_crossings', max(4, size // 10))]:
+            yield name, size, reference, prediction_curve(reference, crossings)
+
+
+def measure(fn, repeat):
+    """
+    :return: (best time in seconds of :repeat runs, peak memory in bytes)
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+
+def run(sizes, max_polygon_size, repeat):
+    results = []
+    for name, size, curve1, curve2 in scenarios(sizes):
+        for engine in CurveDiffEngine:
+            if engine is CurveDiffEngine.polygon and size > max_polygon_size:
+                continue
+            operations = ['get_relative_difference']
+            if engine is CurveDiffEngine.polygon:
+                operations = ['get_intersections', 'get_polygons'] + operations
+            # the object based methods are timed without the conversion of the Curves to Points
+            if engine is CurveDiffEngine.polygon:
+                input1, input2 = curve_to_points(curve1), curve_to_points(curve2)
+            else:
+                input1, input2 = curve1, curve2
+            for operation in operations:
+                def call():
+                    calc = CurveDiffCalculator(input1, input2, 500, engine=engine)
+                    return getattr(calc, operation)()
+
+                seconds, peak_memory = measure(call, repeat)
+                result = {
+                    'scenario': name,
+                    'size': size,
+                    'engine': engine.name,
+                    'operation': operation,
+                    'seconds': seconds,
+                    'peak_memory_bytes': peak_memory,
+                }
+                print(json.dumps(result), file=sys.stderr)
+                results.append(result)
+    return results
+
+
+def runner_throughput(sizes, workers, jobs_per_run=40):
+    """
+    :param workers: list of numbers of worker processes
+    :return: list of results - jobs per second of CurveDiffRunner for each size, input type and number of workers
+    """
+    results = []
+    for size in sizes:
+        reference = occupancy_curve(size, days=max(1, size // (24 * 60)))
+        candidate = prediction_curve(reference, 4)
+        jobs = [(reference, candidate, 500)] * jobs_per_run
+        started = time.perf_counter()
+        for job in jobs:
+            CurveDiffCalculator(*job, engine=CurveDiffEngine.numpy).get_relative_difference()
+        serial = time.perf_counter() - started
+        for max_workers in workers:
+            started = time.perf_counter()
+            list(CurveDiffRunner(max_workers=max_workers, chunk_size=4).run(jobs))
+            seconds = time.perf_counter() - started
+            result = {
+                'scenario': 'runner',
+                'size': size,
+                'engine': CurveDiffEngine.numpy.name,
+                'operation': 'run_%i_workers' % max_workers,
+                'seconds': seconds,
+                'jobs_per_second': jobs_per_run / seconds,
+                'speedup_over_serial': serial / seconds,
+                'peak_memory_bytes': 0,
+            }
+            print(json.dumps(result), file=sys.stderr)
+            results.append(result)
+    return results
+
+
+def compare(results, previous_results):
+    """
+    Print the ratio between the time of each result and the time of the same benchmark in :previous_results
+    """
+    def bench_key(result):
+        return result['scenario'], result['size'], result['engine'], result['operation']
+
+    previous = dict((bench_key(result), result) for result in previous_results)
+    for result in results:
+        before = previous.get(bench_key(result))
+        if before:
+            print("{key}: {ratio:.2f}x time, {memory_ratio:.2f}x memory".format(
+                key=" ".join(str(k) for k in bench_key(result)),
+                ratio=result['seconds'] / before['seconds'],
+                memory_ratio=result['peak_memory_bytes'] / float(max(before['peak_memory_bytes'], 1))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=default_sizes)
+    parser.add_argument('--max-polygon-size', type=int, default=10 ** 4)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--label', default='', help="e.g. the release which is benchmarked")
+    parser.add_argument('--output', help="path of the json file with the results. stdout if not given")
+    parser.add_argument('--compare', help="path of a json file with results of a previous run")
+    parser.add_argument('--runner-workers', type=int, nargs='*', default=[],
+                        help="numbers of worker processes for which to measure the throughput of CurveDiffRunner")
+    args = parser.parse_args()
+
+    report = {
+        'label': args.label,
+        'created': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.platform(),
+        'results': run(args.sizes, args.max_polygon_size, args.repeat),
+    }
+    if args.runner_workers:
+        report['results'] += runner_throughput(args.sizes, args.runner_workers)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            compare(report['results'], json.load(f)['results'])
+
+
+if __name__ == '__main__':
+    main()
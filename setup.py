@@ -7,7 +7,7 @@ from os import path
 
 setup(
     name='thesis_common',
-    version='0.2.1',
+    version='0.3.0',
     description='Common data structures, functions and modules for working with Venue data',
     long_description="Common data structures, functions and modules for working with Venue data",
     url='https://github.com/jorotenev/thesis_venue_common',
@@ -18,10 +18,11 @@ setup(
         'Development Status :: 3 - Alpha',
         'Intended Audience :: Developers',
         'License :: OSI Approved :: MIT License',
-        'Programming Language :: Python :: 3.5',
-        'Programming Language :: Python :: 2.7',
+        'Programming Language :: Python :: 3.6',
+        'Programming Language :: Python :: 3 :: Only',
     ],
+    python_requires='>=3.6',
     packages=find_packages(),
-    install_requires=['python-dateutil', 'redis>=2.10.5','enum34>=1.1.6']
+    install_requires=['python-dateutil', 'redis>=2.10.5', 'numpy']
 
 )
@@ -1,6 +1,35 @@
+import math
+import os
+import time
+from contextlib import contextmanager
 from datetime import datetime as dt
 from unittest import TestCase
 from thesis_common.learning_pipeline.curve_calculations import *
+from thesis_common.learning_pipeline.enums import CurveDiffEngine, CurveMetric
+from thesis_common.learning_pipeline.curve_diff_runner import CurveDiffRunner
+from thesis_common.learning_pipeline.curve_diff_cache import CurveDiffCache
+from thesis_common.learning_pipeline.curve_arrays import Curve, align_curves, regular_grid, simplify
+import numpy as np
+from thesis_common.learning_pipeline import VenueMeasurementDetached
+from datetime import timedelta as td
+
+
+@contextmanager
+def local_timezone(name):
+    """
+    Run the body with :name as the local timezone, e.g. to get the DST changes of that timezone in DatePoint.x
+    """
+    previous = os.environ.get('TZ')
+    os.environ['TZ'] = name
+    time.tzset()
+    try:
+        yield
+    finally:
+        if previous is None:
+            del os.environ['TZ']
+        else:
+            os.environ['TZ'] = previous
+        time.tzset()
 
 
 class TestDatePoint(TestCase):
@@ -10,6 +39,10 @@ class TestDatePoint(TestCase):
         date_point = DatePoint(datetime_object, y)
         self.assertEqual(float, type(date_point.x))
 
+    def test_no_dict(self):
+        date_point = DatePoint(dt.now(), 1)
+        self.assertFalse(hasattr(date_point, '__dict__'))
+
     def test_comparison(self):
         p1 = Point(0, 0)
         p2 = Point(2, 2)
@@ -104,12 +137,30 @@ class TestPolygon(TestCase):
         polygon2 = Polygon(corners2)
         self.assertEqual(polygon1.area, polygon2.area)
 
+    def test_area_ordered_non_convex(self):
+        # the region between two curves which don't cross, curve1 forward and curve2 backward
+        corners = [Point(0, 0), Point(1, 3), Point(2, 0), Point(2, -1), Point(0, -1)]
+        polygon = Polygon(corners, ordered=True)
+        self.assertEqual(5, polygon.area)
+        self.assertEqual([(p.x, p.y) for p in corners], polygon.corners)
+
     def test_no_area(self):
         corners1 = [Point(0, 1), Point(1, 1), Point(2, 1)]
         polygon1 = Polygon(corners1)
         self.assertEqual(0, polygon1.area)
 
 
+class TestSortedCurveIndex(TestCase):
+    def test_queries(self):
+        curve = [Point(x, 0) for x in [4, 0, 2, 6, 8]]
+        index = SortedCurveIndex(curve)
+        self.assertEqual([2, 4, 6], [p.x for p in index.points_between(2, 6)])
+        self.assertEqual([4], [p.x for p in index.points_between(3, 5)])
+        self.assertEqual([], index.points_between(6.5, 7))
+        self.assertEqual([0, 2], [p.x for p in index.points_up_to(2)])
+        self.assertEqual([6, 8], [p.x for p in index.points_from(5)])
+
+
 class TestCurveDiffCalculator(TestCase):
     def test_get_intersections_simple(self):
         p1 = Point(0, 1)
@@ -154,6 +205,50 @@ class TestCurveDiffCalculator(TestCase):
         self.assertTrue(any([inter for inter in intersections if inter.x == 8]))
         self.assertTrue(any([inter for inter in intersections if inter.y == 3]))
 
+    def test_get_intersections_several_on_one_line(self):
+        # the single line of curve1 is crossed four times by curve2
+        curve1 = [Point(0, 0), Point(10, 10)]
+        curve2 = [Point(0, 1), Point(2, 0), Point(4, 5), Point(6, 4), Point(8, 9), Point(10, 11)]
+        curve_diff_calc = CurveDiffCalculator(curve1, curve2, 4)
+        intersections = curve_diff_calc.get_intersections()
+        self.assertEqual(4, len(intersections))
+        self.assertEqual(sorted(intersections), intersections)
+
+    def test_get_intersections_absorbing_line(self):
+        # the second line of curve1 lies within the x-range of the only line of curve2
+        curve1 = [Point(0, 0), Point(4, 0), Point(6, 4), Point(10, 4)]
+        curve2 = [Point(0, 2), Point(10, 2)]
+        curve_diff_calc = CurveDiffCalculator(curve1, curve2, 4)
+        intersections = curve_diff_calc.get_intersections()
+        self.assertEqual(1, len(intersections))
+        self.assertEqual(5, intersections[0].x)
+        self.assertEqual(2, intersections[0].y)
+
+    def test_get_intersections_collinear(self):
+        # the curves overlap between x=2 and x=6, only the start and the end of the overlap are intersections
+        curve1 = [Point(0, 0), Point(2, 2), Point(4, 2), Point(6, 2), Point(8, 0)]
+        curve2 = [Point(0, 4), Point(2, 2), Point(3, 2), Point(6, 2), Point(8, 4)]
+        curve_diff_calc = CurveDiffCalculator(curve1, curve2, 4)
+        intersections = curve_diff_calc.get_intersections()
+        self.assertEqual([Point(2, 2), Point(6, 2)], intersections)
+
+    def test_get_intersections_vertical_line(self):
+        # curve1 jumps from 2 to 0 at x=2 and crosses curve2 on the way
+        curve1 = ([0, 1, 2, 2, 3, 4], [0, 1, 2, 0, 1, 2])
+        curve2 = ([0, 4], [1, 1])
+        curve_diff_calc = CurveDiffCalculator(curve1, curve2, 10)
+        self.assertEqual([Point(1, 1), Point(2, 1), Point(3, 1)], curve_diff_calc.get_intersections())
+        for engine in CurveDiffEngine:
+            curve_diff_calc = CurveDiffCalculator(curve1, curve2, 10, engine=engine)
+            self.assertAlmostEqual(0.05, curve_diff_calc.get_relative_difference())
+
+    def test_get_intersections_vertical_line_of_curve2(self):
+        curve1 = ([0, 4], [1, 1])
+        curve2 = ([0, 2, 2, 4], [0, 0, 2, 2])
+        curve_diff_calc = CurveDiffCalculator(curve1, curve2, 10)
+        self.assertEqual([Point(2, 1)], curve_diff_calc.get_intersections())
+        self.assertAlmostEqual(0.1, curve_diff_calc.get_relative_difference())
+
     def test_get_polygons_one_intersection(self):
         p1 = Point(0, 1)
         p2 = Point(3, 1)
@@ -226,4 +321,378 @@ class TestCurveDiffCalculator(TestCase):
         polygons = curve_diff_calc.get_polygons()
         self.assertEqual(5, len(polygons))
         rel_diff = curve_diff_calc.get_relative_difference()
-        self.assertEqual(0.25, rel_diff)
\ No newline at end of file
+        self.assertEqual(0.25, rel_diff)
+
+class TestCurveDiffCalculatorNumpyEngine(TestCase):
+    def assert_same_as_polygon_engine(self, curve1, curve2, max):
+        polygon_calc = CurveDiffCalculator(curve1, curve2, max)
+        numpy_calc = CurveDiffCalculator(curve1, curve2, max, engine=CurveDiffEngine.numpy)
+        self.assertAlmostEqual(polygon_calc.get_relative_difference(), numpy_calc.get_relative_difference())
+
+    def test_get_relative_difference(self):
+        curve1 = [DatePoint(dt.fromtimestamp(x), y) for x, y in [(0, 0), (2, 2), (4, 0), (6, 2), (8, 0)]]
+        curve2 = [DatePoint(dt.fromtimestamp(x), y) for x, y in [(0, 1), (4, 1), (8, 1)]]
+        curve_diff_calc = CurveDiffCalculator(curve1, curve2, 2, engine=CurveDiffEngine.numpy)
+        self.assertEqual(0.25, curve_diff_calc.get_relative_difference())
+        self.assert_same_as_polygon_engine(curve1, curve2, 2)
+
+    def test_same_as_polygon_engine_one_intersection(self):
+        curve1 = [DatePoint(dt.fromtimestamp(x), y) for x, y in [(0, 1), (3, 1), (5, 3), (7, 3)]]
+        curve2 = [DatePoint(dt.fromtimestamp(x), y) for x, y in [(0, 3), (3, 3), (5, 1), (7, 1)]]
+        self.assert_same_as_polygon_engine(curve1, curve2, 4)
+
+    def test_same_as_polygon_engine_no_intersection(self):
+        curve1 = [DatePoint(dt.fromtimestamp(x), y) for x, y in [(0, 1), (3, 1), (5, 1), (7, 1)]]
+        curve2 = [DatePoint(dt.fromtimestamp(x), y) for x, y in [(7, 3), (0, 3), (3, 3), (5, 3)]]
+        self.assert_same_as_polygon_engine(curve1, curve2, 4)
+
+    def test_different_extents(self):
+        # curve2 starts later and ends earlier, the curves are compared only between x=2 and x=6
+        curve1 = ([0, 2, 4, 6, 8], [0, 2, 0, 2, 0])
+        curve2 = ([2, 4, 6], [1, 1, 1])
+        for engine in CurveDiffEngine:
+            curve_diff_calc = CurveDiffCalculator(curve1, curve2, 2, engine=engine)
+            self.assertAlmostEqual(0.25, curve_diff_calc.get_relative_difference())
+
+    def test_no_overlap(self):
+        curve_diff_calc = CurveDiffCalculator(([0, 2], [0, 0]), ([3, 4], [1, 1]), 2, engine=CurveDiffEngine.numpy)
+        with self.assertRaises(ValueError):
+            curve_diff_calc.get_relative_difference()
+
+    def test_same_as_polygon_engine_random_curves(self):
+        rng = np.random.RandomState(1)
+        for _ in range(50):
+            x1 = np.unique(np.concatenate(([0, 100], rng.randint(1, 100, 20))))
+            x2 = np.unique(np.concatenate(([0, 100], rng.randint(1, 100, 10))))
+            curve1 = [Point(x, y) for x, y in zip(x1, rng.randint(0, 10, x1.size))]
+            curve2 = [Point(x, y) for x, y in zip(x2, rng.randint(0, 10, x2.size))]
+            self.assert_same_as_polygon_engine(curve1, curve2, 10)
+
+    def test_repeated_x(self):
+        # curve1 jumps at x=2 - the area is the one of the step, without a slope on either side of it
+        for y in ([0, 0, 2, 2], [2, 2, 0, 0]):
+            curve1 = ([0, 2, 2, 4], y)
+            curve2 = ([0, 4], [0, 0])
+            curve_diff_calc = CurveDiffCalculator(curve1, curve2, 10, engine=CurveDiffEngine.numpy)
+            self.assertAlmostEqual(0.1, curve_diff_calc.get_relative_difference())
+            self.assertAlmostEqual(0.1, CurveDiffCalculator(curve1, curve2, 10).exceeds(1, first_chunk_size=1)[1])
+            self.assertAlmostEqual(0.1, CurveEvaluator(curve1, curve2, 10).evaluate().relative_difference)
+            self.assertAlmostEqual(0.1, ReferenceCurveDiffCalculator(curve2, 10).get_relative_difference(curve1))
+            self.assert_same_as_polygon_engine(curve1, curve2, 10)
+
+    def test_same_as_polygon_engine_repeated_x(self):
+        rng = np.random.RandomState(2)
+        for _ in range(50):
+            x1 = np.sort(np.concatenate(([0, 100], rng.randint(1, 100, 20))))
+            x2 = np.sort(np.concatenate(([0, 100], rng.randint(1, 100, 10))))
+            curve1 = [Point(x, y) for x, y in zip(x1, rng.randint(0, 10, x1.size))]
+            curve2 = [Point(x, y) for x, y in zip(x2, rng.randint(0, 10, x2.size))]
+            self.assert_same_as_polygon_engine(curve1, curve2, 10)
+
+    def test_repeated_hour_at_end_of_dst(self):
+        # naive local times repeat 02:00 - 02:45 when DST ends
+        start = dt(2017, 10, 29)
+        datetimes = [start + td(minutes=15 * i) for i in range(12)] + \
+                    [start + td(hours=2, minutes=15 * i) for i in range(88)]
+        rng = np.random.RandomState(3)
+        with local_timezone('Europe/Brussels'):
+            curve1 = [DatePoint(d, y) for d, y in zip(datetimes, rng.randint(0, 50, len(datetimes)))]
+            curve2 = [DatePoint(d, y) for d, y in zip(datetimes, rng.randint(0, 50, len(datetimes)))]
+            self.assert_same_as_polygon_engine(curve1, curve2, 50)
+
+    def test_exceeds(self):
+        x = np.arange(1000, dtype=np.float64)
+        # the curves differ only in the beginning
+        curve1 = (x, np.where(x < 10, 10.0, 0.0))
+        curve2 = (x, np.zeros(1000))
+        exact = CurveDiffCalculator(curve1, curve2, 10, engine=CurveDiffEngine.numpy).get_relative_difference()
+
+        exceeds, lower_bound = CurveDiffCalculator(curve1, curve2, 10).exceeds(0.005, first_chunk_size=16)
+        self.assertTrue(exceeds)
+        self.assertLess(0.005, lower_bound)
+        self.assertLessEqual(lower_bound, exact)
+
+        exceeds, relative_difference = CurveDiffCalculator(curve1, curve2, 10).exceeds(0.05, first_chunk_size=16)
+        self.assertFalse(exceeds)
+        self.assertAlmostEqual(exact, relative_difference)
+
+    def test_array_curves(self):
+        curve1 = ([0, 2, 4, 6, 8], [0, 2, 0, 2, 0])
+        curve2 = ([0, 4, 8], [1, 1, 1])
+        curve_diff_calc = CurveDiffCalculator(curve1, curve2, 2, engine=CurveDiffEngine.numpy)
+        self.assertEqual(0.25, curve_diff_calc.get_relative_difference())
+
+    def test_unsorted_array_curve(self):
+        curve1 = ([8, 0, 4], [1, 1, 1])
+        curve2 = ([0, 8], [0, 0])
+        curve_diff_calc = CurveDiffCalculator(curve1, curve2, 1, engine=CurveDiffEngine.numpy)
+        self.assertEqual(1, curve_diff_calc.get_relative_difference())
+
+
+class TestReferenceCurveDiffCalculator(TestCase):
+    def setUp(self):
+        self.reference = ([0, 2, 4, 6, 8], [0, 2, 0, 2, 0])
+        self.candidates = [([0, 4, 8], [1, 1, 1]),
+                           ([0, 4, 8], [0, 2, 0]),
+                           ([0, 4, 8], [0, 0, 0])]
+
+    def expected(self, candidate):
+        return CurveDiffCalculator(self.reference, candidate, 2, engine=CurveDiffEngine.numpy).get_relative_difference()
+
+    def test_get_relative_difference(self):
+        calc = ReferenceCurveDiffCalculator(self.reference, 2)
+        for candidate in self.candidates:
+            self.assertEqual(self.expected(candidate), calc.get_relative_difference(candidate))
+
+    def test_get_relative_differences_shared_grid(self):
+        calc = ReferenceCurveDiffCalculator(self.reference, 2)
+        result = calc.get_relative_differences(self.candidates)
+        self.assertEqual(len(self.candidates), len(result))
+        for candidate, rel_diff in zip(self.candidates, result):
+            self.assertAlmostEqual(self.expected(candidate), rel_diff)
+        self.assertEqual(0.25, result[0])
+
+    def test_get_relative_differences_different_grids(self):
+        calc = ReferenceCurveDiffCalculator(self.reference, 2)
+        candidates = self.candidates + [[Point(0, 1), Point(3, 2), Point(8, 1)]]
+        result = calc.get_relative_differences(candidates)
+        for candidate, rel_diff in zip(candidates, result):
+            self.assertAlmostEqual(self.expected(candidate), rel_diff)
+
+    def test_get_relative_differences_on_grid(self):
+        calc = ReferenceCurveDiffCalculator(self.reference, 2)
+        result = calc.get_relative_differences_on_grid([8, 0, 4], [[1, 1, 1], [0, 2, 0]])
+        self.assertAlmostEqual(0.25, result[0])
+        self.assertAlmostEqual(self.expected(([0, 4, 8], [2, 0, 0])), result[1])
+
+
+class TestCurveDiffRunner(TestCase):
+    def test_run(self):
+        reference = Curve.from_points([DatePoint(dt.fromtimestamp(x), y) for x, y in [(0, 0), (2, 2), (4, 0), (6, 2),
+                                                                                       (8, 0)]])
+        jobs = [(reference, ([0, 4, 8], [i, 1, 0]), 2) for i in range(10)]
+        expected = [CurveDiffCalculator(reference_curve, candidate, max, engine=CurveDiffEngine.numpy)
+                        .get_relative_difference() for reference_curve, candidate, max in jobs]
+
+        runner = CurveDiffRunner(max_workers=2, chunk_size=3, max_pending_chunks=2)
+        result = list(runner.run(iter(jobs)))
+        self.assertEqual(expected, result)
+
+    def test_work_runs_in_workers(self):
+        # a week of minutes
+        datetimes = [dt(2017, 1, 2) + td(minutes=i) for i in range(7 * 24 * 60)]
+        reference = Curve.from_datetimes(datetimes, [i % 50 for i in range(len(datetimes))])
+        candidate = Curve.from_datetimes(datetimes, [i % 40 for i in range(len(datetimes))])
+        jobs = [(reference, candidate, 50) for _ in range(10)]
+
+        started = time.perf_counter()
+        for job in jobs:
+            CurveDiffCalculator(*job, engine=CurveDiffEngine.numpy).get_relative_difference()
+        serial = time.perf_counter() - started
+
+        # what the calling process does, apart from the pickling
+        started = time.perf_counter()
+        chunks = list(CurveDiffRunner(chunk_size=4)._chunks(iter(jobs)))
+        in_caller = time.perf_counter() - started
+
+        self.assertEqual([4, 4, 2], [len(chunk) for chunk in chunks])
+        self.assertLess(in_caller, serial / 20)
+
+    def test_point_lists_are_rejected(self):
+        points = [DatePoint(dt.fromtimestamp(x), 1) for x in range(3)]
+        with self.assertRaises(TypeError):
+            list(CurveDiffRunner()._chunks(iter([(points, ([0, 2], [1, 1]), 1)])))
+
+
+class TestCurve(TestCase):
+    def setUp(self):
+        start = dt(2017, 3, 25, 22, 30, 15, 500)
+        self.datetimes = [start + td(minutes=17 * i) for i in range(500)]
+        self.values = [i % 7 for i in range(500)]
+
+    def test_from_datetimes(self):
+        curve = Curve.from_datetimes(self.datetimes, self.values)
+        self.assertEqual(len(self.datetimes), len(curve))
+        self.assertEqual([DatePoint(d, 0).x for d in self.datetimes], curve.x.tolist())
+        self.assertEqual(self.values, curve.y.tolist())
+
+    def test_from_datetimes_half_hour_dst(self):
+        # Australia/Lord_Howe moves its clocks by 30 minutes, at 02:00
+        skipped = (dt(2017, 10, 1, 2), dt(2017, 10, 1, 2, 30))
+        for day in (dt(2017, 4, 2), dt(2017, 10, 1)):
+            datetimes = [day + td(minutes=7 * i, seconds=13) for i in range(100)]
+            # the times which don't exist have no well defined DatePoint.x - time.mktime() depends on its previous call
+            datetimes = [d for d in datetimes if not skipped[0] <= d < skipped[1]]
+            with local_timezone('Australia/Lord_Howe'):
+                curve = Curve.from_datetimes(datetimes, [0] * len(datetimes))
+                self.assertEqual([DatePoint(d, 0).x for d in datetimes], curve.x.tolist())
+
+    def test_from_venue_measurements(self):
+        vms = [VenueMeasurementDetached(number_of_people=v, timestamp_local=d, venue_capacity=10, venue_name='agora')
+               for d, v in zip(self.datetimes, self.values)]
+        curve = Curve.from_venue_measurements(reversed(vms))
+        self.assertEqual(Curve.from_datetimes(self.datetimes, self.values).x.tolist(), curve.x.tolist())
+        self.assertEqual(self.values, curve.y.tolist())
+
+    def test_from_points(self):
+        points = [DatePoint(d, v) for d, v in zip(self.datetimes, self.values)]
+        curve = Curve.from_points(points)
+        self.assertEqual([p.x for p in points], curve.x.tolist())
+
+    def test_curve_diff_calculator(self):
+        curve1 = Curve([0, 2, 4, 6, 8], [0, 2, 0, 2, 0])
+        curve2 = Curve([0, 4, 8], [1, 1, 1])
+        for engine in CurveDiffEngine:
+            self.assertEqual(0.25, CurveDiffCalculator(curve1, curve2, 2, engine=engine).get_relative_difference())
+        self.assertEqual(4, len(CurveDiffCalculator(curve1, curve2, 2).get_intersections()))
+        self.assertEqual(0.25, ReferenceCurveDiffCalculator(curve1, 2).get_relative_differences([curve2])[0])
+
+
+class TestSlidingWindowCurveDiffCalculator(TestCase):
+    def setUp(self):
+        self.curve1 = [Point(x, y) for x, y in [(0, 0), (2, 2), (4, 0), (6, 2), (8, 0)]]
+        self.curve2 = [Point(x, y) for x, y in [(0, 1), (4, 1), (8, 1)]]
+
+    def test_whole_curves_in_window(self):
+        calc = SlidingWindowCurveDiffCalculator(max=2, window=td(hours=1))
+        self.assertIsNone(calc.get_relative_difference())
+        for p in self.curve1:
+            calc.add_point_to_curve1(p)
+        for p in self.curve2:
+            calc.add_point_to_curve2(p)
+        self.assertEqual(4, calc.area)
+        self.assertEqual(8, calc.duration)
+        self.assertEqual(0.25, calc.get_relative_difference())
+
+    def test_evict(self):
+        calc = SlidingWindowCurveDiffCalculator(max=2, window=4)
+        for p1, p2 in zip(self.curve1, self.curve2):
+            calc.add_point_to_curve1(p1)
+            calc.add_point_to_curve2(p2)
+        for p in self.curve1[len(self.curve2):]:
+            calc.add_point_to_curve1(p)
+        # only the intervals between x=4 and x=8 are within the window
+        self.assertEqual(4, calc.duration)
+        self.assertEqual(2, calc.area)
+        self.assertEqual(0.25, calc.get_relative_difference())
+
+    def test_add_point_not_in_order(self):
+        calc = SlidingWindowCurveDiffCalculator(max=2, window=4)
+        calc.add_point_to_curve1(Point(2, 0))
+        with self.assertRaises(ValueError):
+            calc.add_point_to_curve1(Point(1, 0))
+
+
+class TestCurveEvaluator(TestCase):
+    def test_evaluate(self):
+        curve1 = ([0, 2, 4, 6, 8], [0, 2, 0, 2, 0])
+        curve2 = ([0, 4, 8], [1, 1, 1])
+        result = CurveEvaluator(curve1, curve2, 2).evaluate()
+        self.assertEqual(CurveDiffCalculator(curve1, curve2, 2, engine=CurveDiffEngine.numpy).get_relative_difference(),
+                         result.relative_difference)
+        self.assertEqual(0.5, result.mae)
+        # |curve1 - curve2| is a triangle wave between 0 and 1, so its mean square is 1/3
+        self.assertAlmostEqual(math.sqrt(1 / 3.0), result.rmse)
+        self.assertEqual(1, result.max_error)
+        self.assertEqual(0, result.bias)
+
+    def test_bias(self):
+        result = CurveEvaluator(([0, 10], [3, 3]), ([0, 10], [1, 1]), 4, metrics=[CurveMetric.bias]).evaluate()
+        self.assertEqual(2, result.bias)
+        self.assertIsNone(result.mae)
+        self.assertIsNone(result.relative_difference)
+
+    def test_no_overlap(self):
+        for curve2 in [([11, 20], [1, 1]), ([10, 20], [1, 1])]:
+            with self.assertRaises(ValueError):
+                CurveEvaluator(([0, 10], [3, 3]), curve2, 4).evaluate()
+
+
+class TestAlignCurves(TestCase):
+    def test_union_of_breakpoints(self):
+        grid, y1, y2 = align_curves(([0, 2, 4, 6, 8], [0, 2, 0, 2, 0]), ([1, 5, 9], [1, 1, 1]))
+        self.assertEqual([1, 2, 4, 5, 6, 8], grid.tolist())
+        self.assertEqual([1, 2, 0, 1, 2, 0], y1.tolist())
+        self.assertEqual([1] * 6, y2.tolist())
+
+    def test_step(self):
+        grid, y1, y2 = align_curves(([0, 2, 4, 6, 8], [0, 2, 0, 2, 0]), ([1, 9], [1, 1]), step=3)
+        self.assertEqual([1, 4, 7], grid.tolist())
+        self.assertEqual([1, 0, 1], y1.tolist())
+        self.assertIs(grid, align_curves(([1, 8], [0, 0]), ([0, 7.5], [0, 0]), step=3)[0])
+
+    def test_regular_grid_read_only(self):
+        with self.assertRaises(ValueError):
+            regular_grid(0.0, 1.0, 3)[0] = 1
+
+    def test_no_overlap(self):
+        with self.assertRaises(ValueError):
+            align_curves(([0, 1], [0, 0]), ([2, 3], [0, 0]))
+
+
+class TestSimplify(TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.x = np.arange(2000, dtype=np.float64) * 60
+        # flat stretches with a bit of noise and a few jumps
+        self.y = np.repeat(rng.randint(0, 100, 20), 100) + rng.uniform(-1, 1, 2000)
+
+    def test_error_bound(self):
+        simplified_x, simplified_y = simplify(self.x, self.y, max_error=2)
+        self.assertLess(len(simplified_x), len(self.x) / 10)
+        self.assertEqual((self.x[0], self.x[-1]), (simplified_x[0], simplified_x[-1]))
+        self.assertLessEqual(np.max(np.abs(np.interp(self.x, simplified_x, simplified_y) - self.y)), 2)
+
+    def test_keeps_all_points_without_error(self):
+        simplified_x, _ = simplify(self.x, self.y, max_error=0)
+        self.assertEqual(len(self.x), len(simplified_x))
+
+    def test_relative_difference_within_bound(self):
+        other_y = self.y[::-1].copy()
+        exact = CurveDiffCalculator((self.x, self.y), (self.x, other_y), 100, engine=CurveDiffEngine.numpy)
+        simplified = CurveDiffCalculator((self.x, self.y), (self.x, other_y), 100, engine=CurveDiffEngine.numpy,
+                                         simplification_error=2)
+        bound = simplified.get_relative_difference_error_bound()
+        self.assertEqual(0.04, bound)
+        self.assertLessEqual(abs(exact.get_relative_difference() - simplified.get_relative_difference()), bound)
+
+    def test_duration_of_date_points(self):
+        # on the day DST starts the datetimes span 24 hours, but their epoch seconds only 23 hours
+        start = dt(2017, 3, 26)
+        rng = np.random.RandomState(4)
+        with local_timezone('Europe/Brussels'):
+            curve1 = [DatePoint(start + td(minutes=15 * i), y) for i, y in enumerate(rng.randint(0, 50, 97))]
+            curve2 = [DatePoint(start + td(minutes=15 * i), y) for i, y in enumerate(rng.randint(0, 50, 97))]
+            for engine in CurveDiffEngine:
+                exact = CurveDiffCalculator(curve1, curve2, 50, engine=engine)
+                simplified = CurveDiffCalculator(curve1, curve2, 50, engine=engine, simplification_error=1e-9)
+                self.assertAlmostEqual(exact.get_relative_difference(), simplified.get_relative_difference())
+                # the second call starts from the simplified curves, but keeps the duration of the original ones
+                self.assertAlmostEqual(exact.get_relative_difference(), simplified.get_relative_difference())
+
+
+class TestCurveDiffCache(TestCase):
+    def setUp(self):
+        self.curve1 = ([0, 2, 4, 6, 8], [0, 2, 0, 2, 0])
+        self.curve2 = ([0, 4, 8], [1, 1, 1])
+
+    def test_memory(self):
+        cache = CurveDiffCache(max_size=1)
+        self.assertEqual(0.25, cache.get_relative_difference(self.curve1, self.curve2, 2))
+        # equal contents, different objects
+        self.assertEqual(0.25, cache.get_relative_difference(Curve(*self.curve1), Curve(*self.curve2), 2))
+        self.assertEqual(0.125, cache.get_relative_difference(self.curve1, self.curve2, 4))
+        # the first result was evicted
+        cache.get_relative_difference(self.curve1, self.curve2, 2)
+        self.assertEqual({'hits': 1, 'disk_hits': 0, 'misses': 3, 'size': 1, 'hit_rate': 0.25}, cache.stats)
+
+    def test_disk(self):
+        import shutil
+        import tempfile
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        CurveDiffCache(directory=directory).get_relative_difference(self.curve1, self.curve2, 2)
+        cache = CurveDiffCache(directory=directory)
+        self.assertEqual(0.25, cache.get_relative_difference(self.curve1, self.curve2, 2))
+        self.assertEqual(1, cache.stats['disk_hits'])
+        self.assertEqual(0, cache.stats['misses'])
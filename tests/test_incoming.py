@@ -57,6 +57,21 @@ class TestRawVenueMeasurement(TestCase):
         self.assertEqual(raw_measurement.timestamp_utc, convert_back.timestamp_utc)
         self.assertEqual(raw_measurement.measurement_type, convert_back.measurement_type)
 
+    def test_deserialize_skips_validation(self):
+        raw_measurement = create_raw_measurement()
+        json_string = json.dumps(raw_measurement, cls=CustomJsonEncoder)
+        # data we serialized ourselves is trusted and not validated again
+        tampered = json_string.replace('"number_of_people": 10', '"number_of_people": "10"')
+        convert_back = json.loads(tampered, object_hook=deserialize_obj_hook)
+        self.assertEqual("10", convert_back.number_of_people)
+        self.assertEqual(raw_measurement.metadata, convert_back.metadata)
+
+    def test_deserialize_default_value(self):
+        raw_measurement = create_raw_measurement()
+        json_string = json.dumps(raw_measurement, cls=CustomJsonEncoder)
+        json_string = json_string.replace(', "metadata": {"venue_token": "123"}', '')
+        self.assertEqual({}, json.loads(json_string, object_hook=deserialize_obj_hook).metadata)
+
     def test_ensure_timestamp_is_utc(self):
         self.assertFalse(False)
 
@@ -1,10 +1,11 @@
 from __future__ import absolute_import
 from thesis_common.learning_pipeline import VenueMeasurementDetached, Label, LearningMode
-from thesis_common import CustomJsonEncoder, deserialize_obj_hook
+from thesis_common import CustomJsonEncoder, deserialize_obj_hook, iter_encode, iter_decode, ColumnarBatch
 from thesis_common import VenueInformation
 from unittest import TestCase
 from datetime import datetime as dt
 import json
+import io
 
 
 class TestVenueMeasurementDetached(TestCase):
@@ -70,3 +71,172 @@ class TestPublicDataTypes(TestCase):
         deser = json.loads(json_str, object_hook=deserialize_obj_hook)
 
         self.assertEqual(deser.newest_measurement_dt_local, now)
+
+
+class TestCustomJsonEncoder(TestCase):
+    def test_class_registered_later(self):
+        from thesis_common import make_class_serializable
+
+        class RegisteredLater(object):
+            def __init__(self, value):
+                self.value = value
+
+        with self.assertRaises(TypeError):
+            json.dumps(RegisteredLater(1), cls=CustomJsonEncoder)
+        make_class_serializable(RegisteredLater)
+        self.assertEqual({"__RegisteredLater__": {"value": 1}},
+                         json.loads(json.dumps(RegisteredLater(1), cls=CustomJsonEncoder)))
+
+    def test_validate(self):
+        from thesis_common import make_class_serializable
+
+        class Validated(object):
+            def __init__(self, value, other=2):
+                if value < 0:
+                    raise ValueError("value should be positive")
+                self.value = value
+                self.other = other
+
+        make_class_serializable(Validated, validate=True)
+        json_str = json.dumps(Validated(1), cls=CustomJsonEncoder)
+        self.assertEqual(2, json.loads(json_str, object_hook=deserialize_obj_hook).other)
+        with self.assertRaises(ValueError):
+            json.loads(json_str.replace('1', '-1'), object_hook=deserialize_obj_hook)
+
+    def test_attributes_which_are_not_constructor_parameters(self):
+        from thesis_common import make_class_serializable
+
+        class WithDerived(object):
+            def __init__(self, value):
+                self.value = value
+                self.derived = value * 2
+
+        make_class_serializable(WithDerived)
+        with self.assertRaises(ValueError):
+            json.dumps(WithDerived(1), cls=CustomJsonEncoder)
+
+    def test_fields(self):
+        from thesis_common import make_class_serializable
+
+        class WithFields(object):
+            def __init__(self, *args):
+                self.first, self.second = args
+                self.not_serialized = True
+
+        make_class_serializable(WithFields, fields=['first', 'second'])
+        json_str = json.dumps(WithFields(1, 2), cls=CustomJsonEncoder)
+        self.assertEqual({"__WithFields__": {"first": 1, "second": 2}}, json.loads(json_str))
+        deserialized = json.loads(json_str, object_hook=deserialize_obj_hook)
+        self.assertEqual((1, 2), (deserialized.first, deserialized.second))
+
+    def test_subclass_of_registered_class_is_not_serializable(self):
+        class Subclass(VenueInformation):
+            pass
+
+        now = dt.now()
+        with self.assertRaises(TypeError):
+            json.dumps(Subclass(now, now, now, now, 1, 1), cls=CustomJsonEncoder)
+
+
+class TestDeserializeObjHook(TestCase):
+    def test_plain_dicts(self):
+        dikt = {"__enum__": "not a tag, because there's a second key", "other": 1}
+        self.assertEqual({"a": {"b": dikt}},
+                         json.loads(json.dumps({"a": {"b": dikt}}), object_hook=deserialize_obj_hook))
+        self.assertEqual({"__unknown__": 1}, json.loads('{"__unknown__": 1}', object_hook=deserialize_obj_hook))
+
+    def test_datetimes(self):
+        from datetime import timedelta as td, tzinfo
+
+        class PlusTwo(tzinfo):
+            def utcoffset(self, dt):
+                return td(hours=2)
+
+        naive = dt(2017, 1, 2, 8, 1, 0)
+        for value in [naive, naive.replace(microsecond=123), naive.replace(tzinfo=PlusTwo())]:
+            json_str = json.dumps(value, cls=CustomJsonEncoder)
+            self.assertEqual(value.replace(tzinfo=None), json.loads(json_str, object_hook=deserialize_obj_hook))
+        # not produced by CustomJsonEncoder, but still understood
+        self.assertEqual(naive, json.loads('{"__datetime__": "2 Jan 2017 08:01"}', object_hook=deserialize_obj_hook))
+
+    def test_same_class_name(self):
+        from thesis_common import make_class_serializable
+
+        class VenueInformation(object):
+            pass
+
+        with self.assertRaises(ValueError):
+            make_class_serializable(VenueInformation)
+
+
+class TestJsonLines(TestCase):
+    def test_round_trip(self):
+        measurements = [VenueMeasurementDetached(number_of_people=i, timestamp_local=dt(2017, 1, 1, 10, i),
+                                                 venue_name="Gym1", venue_capacity=100) for i in range(5)]
+        fp = io.StringIO()
+        self.assertEqual(6, iter_encode((obj for obj in measurements + [LearningMode.live]), fp))
+        self.assertEqual(6, len(fp.getvalue().splitlines()))
+        fp.seek(0)
+        decoded = list(iter_decode(fp))
+        self.assertEqual([vm.number_of_people for vm in measurements], [vm.number_of_people for vm in decoded[:-1]])
+        self.assertEqual(measurements[-1].timestamp_local, decoded[-2].timestamp_local)
+        self.assertEqual(LearningMode.live, decoded[-1])
+
+    def test_newlines_in_strings(self):
+        fp = io.StringIO()
+        iter_encode([{"a": "multi\nline"}, "second"], fp)
+        fp.seek(0)
+        self.assertEqual([{"a": "multi\nline"}, "second"], list(iter_decode(fp)))
+
+    def test_skips_empty_lines(self):
+        self.assertEqual([1, 2], list(iter_decode(io.StringIO(u"1\n\n2\n"))))
+
+
+class TestColumnarBatch(TestCase):
+    def setUp(self):
+        self.measurements = [VenueMeasurementDetached(number_of_people=i, timestamp_local=dt(2017, 3, 26, 1, i),
+                                                      venue_name="Gym%i" % (i % 2), venue_capacity=100)
+                             for i in range(60)]
+
+    def round_trip(self, batch):
+        return json.loads(json.dumps(batch, cls=CustomJsonEncoder), object_hook=deserialize_obj_hook)
+
+    def test_round_trip(self):
+        decoded = self.round_trip(ColumnarBatch.from_objects(self.measurements))
+        self.assertEqual(len(self.measurements), len(decoded))
+        for expected, actual in zip(self.measurements, decoded):
+            self.assertIsInstance(actual, VenueMeasurementDetached)
+            self.assertEqual(vars(expected), vars(actual))
+
+    def test_smaller_than_list(self):
+        columnar = json.dumps(ColumnarBatch.from_objects(self.measurements), cls=CustomJsonEncoder)
+        as_list = json.dumps(self.measurements, cls=CustomJsonEncoder)
+        self.assertLess(len(columnar) * 3, len(as_list))
+
+    def test_encodings(self):
+        batch = ColumnarBatch.from_objects(self.measurements)
+        encodings = dict(zip(batch.fields, [column['encoding'] for column in batch.columns]))
+        self.assertEqual('epoch_seconds', encodings['timestamp_local'])
+        self.assertEqual('dictionary', encodings['venue_name'])
+        self.assertEqual('plain', encodings['number_of_people'])
+
+    def test_microseconds(self):
+        now = dt.now().replace(microsecond=123456)
+        vm = VenueMeasurementDetached(number_of_people=1, timestamp_local=now, venue_name="Gym", venue_capacity=1)
+        self.assertEqual([now], self.round_trip(ColumnarBatch.from_objects([vm])).column('timestamp_local'))
+
+    def test_arrays(self):
+        arrays = self.round_trip(ColumnarBatch.from_objects(self.measurements)).arrays()
+        self.assertEqual(list(range(60)), arrays['number_of_people'].tolist())
+        self.assertEqual(dt(2017, 3, 26, 1, 59), arrays['timestamp_local'][-1].astype(dt))
+        self.assertEqual(["Gym0", "Gym1"], arrays['venue_name'][:2].tolist())
+
+    def test_empty(self):
+        batch = self.round_trip(ColumnarBatch.from_objects([], object_class=VenueMeasurementDetached))
+        self.assertEqual([], batch.to_list())
+        with self.assertRaises(ValueError):
+            ColumnarBatch.from_objects([])
+
+    def test_different_classes(self):
+        with self.assertRaises(ValueError):
+            ColumnarBatch.from_objects(self.measurements + [Label.daily])
@@ -4,9 +4,10 @@ from time import sleep
 from multiprocessing import Process
 from datetime import datetime as dt, timedelta as td
 from thesis_common.learning_pipeline.redis_adapter import StoredPredictionsAdapter, TrainingDataRedisAdapter, key, \
-    venue_wildcard_key
-from thesis_common.learning_pipeline.redis_adapter import configure_redis_for_testing
-from thesis_common.learning_pipeline import Label
+    venue_wildcard_key, venues_key, venue_registry_key, registry_migrated_key
+from thesis_common.learning_pipeline.redis_adapter import configure_redis_for_testing, PayloadCodec
+from thesis_common.learning_pipeline.redis_adapter.snapshot_deltas import delta_prefix
+from thesis_common.learning_pipeline import Label, CompressionAlgorithm
 from unittest import TestCase
 
 
@@ -80,7 +81,8 @@ class TestTrainingDataRedisAdapter(TestCase):
 
         # there are entries in the redis for both cylinders
         # and they are no other keys
-        self.assertEqual(set([self.key_cylinder_1, self.key_cylinder_2]), set(self.raw_redis_client.keys("*")))
+        self.assertEqual(set([self.key_cylinder_1, self.key_cylinder_2, venues_key, venue_registry_key(self.venue)]),
+                         set(self.raw_redis_client.keys("*")))
 
         # let's assert the len of both queues is correct
         self.assertEqual(len(self.cyl_1_input_list), self.raw_redis_client.llen(self.key_cylinder_1))
@@ -102,6 +104,23 @@ class TestTrainingDataRedisAdapter(TestCase):
         self.assertEqual(0, self.raw_redis_client.llen(self.key_cylinder_1))
         self.assertEqual(0, self.raw_redis_client.llen(self.key_cylinder_2))
 
+    def test_atomic_cylinders_enqueue_lengths(self):
+        dikt = {self.cyl_1_label: "[1]", self.cyl_2_label: "[2]"}
+        expected_length = len(self.cyl_1_input_list) + 1
+        self.assertEqual({self.cyl_1_label: expected_length, self.cyl_2_label: expected_length},
+                         self.adapter.atomic_cylinders_enqueue(venue=self.venue, cylinders_dikt=dikt))
+
+        self.adapter.dequeue_from_cylinder_queue_of_venue(venue=self.venue, cylinder_label=self.cyl_1_label)
+        with self.assertRaises(RuntimeError):
+            self.adapter.atomic_cylinders_enqueue(venue=self.venue, cylinders_dikt=dikt)
+        # nothing was enqueued
+        self.assertEqual(expected_length - 1, self.adapter.get_size_of_cylinder_queue(self.venue, self.cyl_1_label))
+        self.assertEqual(expected_length, self.adapter.get_size_of_cylinder_queue(self.venue, self.cyl_2_label))
+
+    def test_atomic_cylinders_enqueue_nothing(self):
+        with self.assertRaises(ValueError):
+            self.adapter.atomic_cylinders_enqueue(venue=self.venue, cylinders_dikt={})
+
     def test_get_cylinder_queue_of_venue(self):
 
         for cyl_label, cyl_queue in zip(self.labels, self.input_lists):
@@ -140,6 +159,64 @@ class TestTrainingDataRedisAdapter(TestCase):
             self.assertEqual(0, size)
             self.assertIsNone(self.adapter.dequeue_from_cylinder_queue_of_venue(venue=self.venue, cylinder_label=label))
 
+    def test_get_queues_for_venues(self):
+        other_venue = 'other venue'
+        self.adapter.atomic_cylinders_enqueue(venue=other_venue, cylinders_dikt={self.cyl_1_label: "[1]"})
+        expected = {self.venue: self.adapter.get_queues_for_venue(self.venue),
+                    other_venue: {key(other_venue, self.cyl_1_label): ["[1]"]},
+                    'no such venue': {}}
+        self.assertEqual(expected, self.adapter.get_queues_for_venues(list(expected.keys())))
+        self.assertEqual(expected,
+                         self.adapter.get_queues_for_venues(list(expected.keys()), cylinder_labels=self.labels))
+
+    def test_get_queues_for_venues_round_trips(self):
+        expected = self.adapter.get_queues_for_venues([self.venue])
+        queues, round_trips = self.round_trips_of(lambda: self.adapter.get_queues_for_venues([self.venue]))
+        self.assertEqual(expected, queues)
+        # the key registry and the queues
+        self.assertEqual(['PIPELINE', 'PIPELINE'], round_trips)
+
+        queues, round_trips = self.round_trips_of(
+            lambda: self.adapter.get_queues_for_venues([self.venue], cylinder_labels=self.labels))
+        self.assertEqual(expected, queues)
+        self.assertEqual(['PIPELINE'], round_trips)
+
+    def round_trips_of(self, call):
+        """
+        :return: the result of :call and a list with an entry for each round trip to redis it made - the name of a
+        command sent on its own, or 'PIPELINE'
+        """
+        round_trips = []
+
+        def count_command(execute_command):
+            def execute(*args, **kwargs):
+                round_trips.append(args[0])
+                return execute_command(*args, **kwargs)
+            return execute
+
+        def count_pipeline(pipeline):
+            def create(*args, **kwargs):
+                pipe = pipeline(*args, **kwargs)
+                execute = pipe.execute
+
+                def execute_pipeline(*execute_args, **execute_kwargs):
+                    round_trips.append('PIPELINE')
+                    return execute(*execute_args, **execute_kwargs)
+                pipe.execute = execute_pipeline
+                return pipe
+            return create
+
+        clients = set([self.adapter.r, self.adapter.raw])
+        for client in clients:
+            client.execute_command = count_command(client.execute_command)
+            client.pipeline = count_pipeline(client.pipeline)
+        try:
+            return call(), round_trips
+        finally:
+            for client in clients:
+                del client.execute_command
+                del client.pipeline
+
     def test_get_venue_labels(self):
 
         # note that the labels are represented by their string representations,
@@ -157,6 +234,59 @@ class TestTrainingDataRedisAdapter(TestCase):
         expected_labels = self.labels
         self.assertEqual(set(expected_labels), set(labels))
 
+    def test_key_registry(self):
+        self.adapter.atomic_cylinders_enqueue(venue='other venue', cylinders_dikt={self.cyl_1_label: "[]"})
+        self.assertEqual(set([self.venue, 'other venue']), self.adapter.get_venues())
+        self.assertEqual(sorted([self.key_cylinder_1, self.key_cylinder_2]), self.adapter.get_keys_of_venue(self.venue))
+
+        # a queue which was emptied doesn't exist anymore
+        self.raw_redis_client.delete(self.key_cylinder_2)
+        self.assertEqual([self.cyl_1_label], self.adapter.get_venue_labels(self.venue))
+        self.assertEqual([self.key_cylinder_1], list(self.adapter.get_queues_for_venue(self.venue).keys()))
+
+    def test_keys_without_registry(self):
+        # a database written by 0.2.1 - the key of cylinder 2 isn't registered, while a newer writer already
+        # registered the key of cylinder 1
+        self.raw_redis_client.delete(venues_key, venue_registry_key(self.venue), registry_migrated_key)
+        self.raw_redis_client.sadd(venue_registry_key(self.venue), self.key_cylinder_1)
+        lookups = [lambda adapter: set(adapter.get_venue_labels(self.venue)),
+                   lambda adapter: set(adapter.get_queues_for_venues([self.venue])[self.venue]),
+                   lambda adapter: adapter.get_venues()]
+        expected = [set(self.labels), set([self.key_cylinder_1, self.key_cylinder_2]), set([self.venue])]
+        for lookup, expected_result in zip(lookups, expected):
+            self.raw_redis_client.delete(registry_migrated_key)
+            self.assertEqual(expected_result, lookup(self.new_adapter()))
+            self.assertTrue(self.raw_redis_client.exists(registry_migrated_key))
+
+    def test_no_scan_after_migration(self):
+        adapter = self.new_adapter()
+        adapter.get_venues()
+
+        def scan_keys(*args, **kwargs):
+            raise AssertionError("The keys were scanned")
+        for adapter in (adapter, self.new_adapter()):
+            adapter.scan_keys = scan_keys
+            self.assertEqual({}, adapter.get_queues_for_venue('no such venue'))
+            self.assertEqual([], adapter.get_keys_of_venue('no such venue'))
+            self.assertEqual(set([self.venue]), adapter.get_venues())
+
+    def test_rebuild_key_registry(self):
+        self.raw_redis_client.delete(venues_key, venue_registry_key(self.venue), registry_migrated_key)
+        self.adapter.rebuild_key_registry()
+        self.assertEqual(set([self.key_cylinder_1, self.key_cylinder_2]),
+                         self.raw_redis_client.smembers(venue_registry_key(self.venue)))
+        self.assertTrue(self.raw_redis_client.exists(registry_migrated_key))
+        self.assertEqual(set(self.labels), set(self.adapter.get_venue_labels(self.venue)))
+        self.assertEqual(set([self.venue]), self.adapter.get_venues())
+
+    def new_adapter(self):
+        return TrainingDataRedisAdapter(delta_snapshots=self.adapter.delta_snapshots,
+                                        keyframe_interval=self.adapter.keyframe_interval)
+
+    def test_scan_keys(self):
+        self.assertEqual(set([self.key_cylinder_1, self.key_cylinder_2]),
+                         set(self.adapter.scan_keys(venue_wildcard_key(self.venue), count=1)))
+
     def test_get_size_of_cylinder_queue(self):
         for label, queue in zip(self.labels, self.input_lists):
             self.assertEqual(len(queue), self.adapter.get_size_of_cylinder_queue(self.venue, label))
@@ -195,6 +325,29 @@ class TestTrainingDataRedisAdapter(TestCase):
             self.assertIsNone(result_dict[self.cyl_1_label])
             self.assertIsNone(result_dict[self.cyl_2_label])
 
+    def test_uncompressed_by_default(self):
+        snapshot = json.dumps(list(range(1000)))
+        self.adapter.atomic_cylinders_enqueue(venue=self.venue,
+                                              cylinders_dikt={self.cyl_1_label: snapshot, self.cyl_2_label: snapshot})
+        self.assertEqual(snapshot, self.adapter.r.lindex(self.key_cylinder_1, 0))
+
+    def test_compressed_snapshots(self):
+        self.addCleanup(setattr, self.adapter, 'codec', self.adapter.codec)
+        self.adapter.codec = PayloadCodec()
+        snapshot = json.dumps(list(range(1000)))
+        self.adapter.atomic_cylinders_enqueue(venue=self.venue,
+                                              cylinders_dikt={self.cyl_1_label: snapshot, self.cyl_2_label: snapshot})
+        stored = self.adapter.raw.lindex(self.key_cylinder_1, 0)
+        self.assertTrue(stored.startswith(b'\x00z'))
+        self.assertLess(len(stored), len(snapshot))
+        self.assertGreater(self.adapter.compression_stats['compressed_values'], 0)
+
+        self.assertEqual(snapshot, self.adapter.get_cylinder_queue_of_venue(self.venue, self.cyl_1_label)[0])
+        self.assertEqual(snapshot, self.adapter.get_queues_for_venue(self.venue)[self.key_cylinder_2][0])
+        # the uncompressed snapshots, enqueued before, are read as well
+        queue = self.adapter.get_cylinder_queue_of_venue(self.venue, self.cyl_1_label)
+        self.assertEqual(self.cyl_1_input_list[-1], json.loads(queue[1]))
+
     def ensure_blocking_dequeue_blocks(self, label, process):
         """
         For an **empty** queue of a cylinder with label `label`, ensure that a blocking dequeue() really blocks
@@ -237,6 +390,48 @@ class TestTrainingDataRedisAdapter(TestCase):
             assert q_size == 0, "failed to deplete queue [%s]" % key(self.venue, label)
 
 
+class TestTrainingDataRedisAdapterDeltaSnapshots(TestTrainingDataRedisAdapter):
+    """
+    Runs all tests of TestTrainingDataRedisAdapter with an adapter which stores deltas of the snapshots
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        configure_redis_for_testing()
+        cls.adapter = TrainingDataRedisAdapter(delta_snapshots=True, keyframe_interval=4)
+        cls.adapter.drop_db()
+
+    def stored_entries(self, queue_name):
+        return [entry.decode('utf-8') for entry in reversed(self.adapter.raw.lrange(queue_name, 0, -1))]
+
+    def test_atomic_cylinders_enqueue(self):
+        entries = self.stored_entries(self.key_cylinder_1)
+        # the two oldest snapshots are full, then every 4th
+        self.assertEqual([False, False, True, True, True, False, True, True, True, False],
+                         [entry.startswith(delta_prefix) for entry in entries])
+        self.assertLess(sum(len(entry) for entry in entries),
+                        sum(len(json.dumps(snapshot)) for snapshot in self.cyl_1_input_list) * 0.6)
+
+    def test_dequeue_keeps_oldest_full(self):
+        for _ in range(3):
+            self.adapter.dequeue_from_cylinder_queue_of_venue(venue=self.venue, cylinder_label=self.cyl_1_label)
+            entries = self.stored_entries(self.key_cylinder_1)
+            self.assertFalse(entries[0].startswith(delta_prefix))
+            self.assertFalse(entries[1].startswith(delta_prefix))
+        queue = self.adapter.get_cylinder_queue_of_venue(venue=self.venue, cylinder=self.cyl_1_label)
+        self.assertEqual(self.cyl_1_input_list[3:], list(reversed([json.loads(l) for l in queue])))
+
+    def test_snapshots_without_overlap(self):
+        self.adapter.drop_db()
+        snapshots = [[i] for i in range(5)]
+        for snapshot in snapshots:
+            self.adapter.atomic_cylinders_enqueue(venue=self.venue,
+                                                  cylinders_dikt={self.cyl_1_label: json.dumps(snapshot)})
+        self.assertFalse(any(entry.startswith(delta_prefix) for entry in self.stored_entries(self.key_cylinder_1)))
+        queue = self.adapter.get_cylinder_queue_of_venue(venue=self.venue, cylinder=self.cyl_1_label)
+        self.assertEqual(snapshots, list(reversed([json.loads(l) for l in queue])))
+
+
 class TestStoredPredictionsRedisAdapter(TestCase):
     def setUp(self):
         self.default_set_of_predictions = "this will normally be a json string with a map b/w datatime and an int prediction"
@@ -262,6 +457,18 @@ class TestStoredPredictionsRedisAdapter(TestCase):
         self.assertIsNotNone(self.raw_redis_client.get(self.key_for_oldest_predictions),
                              "There's not content under key: %s" % self.key_for_oldest_predictions)
 
+    def test_store_predictions_twice(self):
+        with self.assertRaises(ValueError):
+            self.adapter.store_predictions(venue=self.default_venue, predictions="other predictions",
+                                           datetime_newest_training=self.default_datetime_newest_training_data)
+        self.assertEqual(1, len(self.adapter.get_keys_of_available_predictions_for_venue(self.default_venue)))
+
+    def test_key_registry(self):
+        self.assertEqual(set([self.default_venue]), self.adapter.get_venues())
+        self.assertEqual(sorted([self.key_for_oldest_predictions,
+                                 key(self.default_venue, StoredPredictionsAdapter._predictions_stack_tag)]),
+                         self.adapter.get_keys_of_venue(self.default_venue))
+
     def test_add_avaialable_predictions(self):
         key_of_auxiliary_data_structure = key(self.default_venue, StoredPredictionsAdapter._predictions_stack_tag)
         self.assertEqual(1, self.raw_redis_client.llen(key_of_auxiliary_data_structure),
@@ -299,6 +506,17 @@ class TestStoredPredictionsRedisAdapter(TestCase):
                          "The timestamp of the newest entry used to train the predictor model doesn't match the expected one")
         self.assertEqual(predictions, self.default_set_of_predictions)
 
+    def test_get_compressed_predictions(self):
+        self.addCleanup(setattr, self.adapter, 'codec', self.adapter.codec)
+        self.adapter.codec = PayloadCodec()
+        predictions = json.dumps(dict(("2017-01-01T%02i:%02i:00" % (h, m), h * m) for h in range(24) for m in range(60)))
+        new_dt = self.default_datetime_newest_training_data + td(hours=1)
+        self.adapter.store_predictions(venue=self.default_venue, predictions=predictions,
+                                       datetime_newest_training=new_dt)
+        predictions_key = self.adapter.get_key_of_newest_predictions(self.default_venue)
+        self.assertLess(len(self.adapter.raw.get(predictions_key)), len(predictions) / 3)
+        self.assertEqual((new_dt, predictions), self.adapter.get_predictions(predictions_key))
+
     def add_set_of_predictions(self, offset_in_hours):
         """
         Add a new prediction for the default venue.
@@ -313,3 +531,40 @@ class TestStoredPredictionsRedisAdapter(TestCase):
 
         key_of_new_predictions = key(self.default_venue, new_dt.replace(microsecond=0).isoformat())
         return key_of_new_predictions
+
+
+class TestPayloadCodec(TestCase):
+    def setUp(self):
+        self.value = json.dumps([{"number_of_people": i % 50, "venue_name": "agora"} for i in range(200)])
+
+    def test_round_trip(self):
+        for algorithm in CompressionAlgorithm:
+            codec = PayloadCodec(algorithm=algorithm)
+            encoded = codec.encode(self.value)
+            self.assertIsInstance(encoded, bytes)
+            self.assertLess(len(encoded), len(self.value))
+            self.assertEqual(self.value, codec.decode(encoded))
+            self.assertEqual(self.value.encode('utf-8'), codec.decode(encoded, decode_responses=False))
+
+    def test_threshold(self):
+        codec = PayloadCodec(threshold=len(self.value) + 1)
+        self.assertIs(self.value, codec.encode(self.value))
+        self.assertIs(self.value, PayloadCodec(threshold=None).encode(self.value))
+
+    def test_uncompressed_values(self):
+        codec = PayloadCodec()
+        self.assertEqual(self.value, codec.decode(self.value.encode('utf-8')))
+        self.assertEqual(self.value, codec.decode(self.value))
+        self.assertIsNone(codec.decode(None))
+        with self.assertRaises(ValueError):
+            codec.decode(b'\x00?data')
+
+    def test_stats(self):
+        codec = PayloadCodec()
+        codec.encode(self.value)
+        codec.encode("short")
+        stats = codec.stats
+        self.assertEqual(2, stats['encoded_values'])
+        self.assertEqual(1, stats['compressed_values'])
+        self.assertEqual(len(self.value) + 5, stats['bytes_before'])
+        self.assertGreater(stats['ratio'], 5)
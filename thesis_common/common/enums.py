@@ -10,6 +10,8 @@ All enum classes used in this lib should be defined in this file, so that the `e
 # This is needed because the json deserializer needs to have access to all
 # enums when deserializing
 _registered_enums = []
+# the same enums, by name. Used by the json deserializer
+_enum_classes_by_name = {}
 
 
 def make_enum_serialazable(module_name):
@@ -20,9 +22,13 @@ def make_enum_serialazable(module_name):
     :return:
     """
     global _registered_enums
+    # json_serialize imports this module, so import it only when it's needed
+    from .json_serialize import _register_enum_encoder
     for enumName, enumCls in inspect.getmembers(sys.modules[module_name], inspect.isclass):
         if issubclass(enumCls, SerializableEnum) and enumCls not in _registered_enums:
             _registered_enums.append(enumCls)
+            _enum_classes_by_name[enumCls.__name__] = enumCls
+            _register_enum_encoder(enumCls)
 
 
 class SerializableEnum(Enum):
@@ -49,11 +55,6 @@ class SerializableEnum(Enum):
 
 def _enum_classes():
     """
-    :return: returns all subclasses of SerializableEnum (including SerializableEnum)
+    :return: dict with the names and the classes of all registered subclasses of SerializableEnum
     """
-
-    result = {}
-    for enumCls in _registered_enums:
-        if issubclass(enumCls, SerializableEnum):
-            result[enumCls.__name__] = enumCls
-    return result
+    return _enum_classes_by_name
@@ -1,21 +1,159 @@
 # start import ensures that the enum is in the namespace so that getattr() works
+import inspect
 import json
-from datetime import datetime
+import re
+from datetime import datetime, timedelta
 import dateutil.parser
 from .enums import _enum_classes
 
 _registered_serializable_classes = []
+# class -> names of the attributes its encoder writes
+_serializable_fields = {}
 
 
-def make_class_serializable(cls):
+def _encode_datetime(obj):
+    return {"__datetime__": obj.isoformat()}
+
+
+def _encode_enum(obj):
+    return {"__enum__": str(obj)}
+
+
+if hasattr(datetime, 'fromisoformat'):
+    _parse_isoformat = datetime.fromisoformat
+else:
+    # python 3.6 doesn't have fromisoformat().
+    # what datetime.isoformat() produces: date, time, optional microseconds and optional UTC offset
+    _isoformat_pattern = re.compile(
+        r'^(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)(?:\.(\d{6}))?(?:[+-]\d\d:\d\d(?::\d\d(?:\.\d{6})?)?)?$')
+
+    def _parse_isoformat(value):
+        match = _isoformat_pattern.match(value)
+        if not match:
+            raise ValueError("Not an isoformat() string: %s" % value)
+        return datetime(*[int(group) for group in match.groups(0)])
+
+
+def _decode_datetime(value):
+    """
+    CustomJsonEncoder writes datetimes with isoformat(), which the fixed-format parser handles much faster than
+    dateutil. dateutil is used only for strings in any other format.
+    The timezone is dropped (not converted), like dateutil.parser.parse(value).replace(tzinfo=None) would do.
+    """
+    try:
+        return _parse_isoformat(value).replace(tzinfo=None)
+    except ValueError:
+        return dateutil.parser.parse(value).replace(tzinfo=None)
+
+
+def _decode_enum(value):
+    name, member = value.split(".")
+    return getattr(_enum_classes()[name], member)
+
+
+# type -> function returning the json-serializable representation of an object of this type.
+# Kept up to date by make_class_serializable() and make_enum_serialazable(), so that encoding
+# an object is a single dict lookup.
+_encoders = {datetime: _encode_datetime}
+# tag -> function creating the object from the value under the tag. Kept up to date by make_class_serializable().
+_decoders = {"__datetime__": _decode_datetime, "__enum__": _decode_enum}
+
+
+def make_class_serializable(cls, fields=None, validate=False):
     """
     Call this method to make a class json-serializable.
+    An encode and a decode function specialised for the class are generated here, once.
+    The encoder writes the :fields attributes of the object. The decoder, by default, trusts the data (we produced
+    it ourselves with the encoder) - it creates the object without calling __init__(), so e.g. input validation
+    is skipped, and sets the attributes directly. Missing attributes get the default value of the constructor.
     :param cls:
+    :param fields: names of the attributes to serialize. By default the parameters of the constructor of :cls -
+    the convention in this lib is that each constructor parameter is stored in an attribute with the same name.
+    In that case the first encoded object is checked to follow the convention: if it has other attributes (e.g.
+    ones calculated in __init__(), which the decoder wouldn't set), the encoding raises a ValueError. Pass
+    :fields to serialize a different set of attributes.
+    :param validate: if True, the decoder creates the objects with cls(**attributes), so that the constructor
+    can validate them.
     :return:
+    :raises ValueError - if another class with the same name is already serializable
     """
     global _registered_serializable_classes
     if cls not in _registered_serializable_classes:
+        cls_name = _serialazable_cls_name(cls)
+        if cls_name in _decoders:
+            raise ValueError("A class named {name} is already serializable".format(name=cls.__name__))
+        constructor_fields, defaults = _constructor_parameters(cls)
+        check_attributes = fields is None
+        fields = list(fields or constructor_fields)
+        encode, decode = _compile_serializers(cls, cls_name, fields, defaults, validate)
+        if check_attributes:
+            encode = _check_attributes_once(cls, fields, encode)
         _registered_serializable_classes.append(cls)
+        _serializable_fields[cls] = fields
+        _encoders[cls] = encode
+        _decoders[cls_name] = decode
+
+
+def _constructor_parameters(cls):
+    """
+    :return: (names of the parameters of cls.__init__ without self, dict with the default values of the parameters)
+    """
+    if cls.__init__ is object.__init__:
+        return [], {}
+    parameters = list(inspect.signature(cls.__init__).parameters.values())[1:]
+    parameters = [p for p in parameters if p.kind in (p.POSITIONAL_OR_KEYWORD, p.KEYWORD_ONLY)]
+    return [p.name for p in parameters], dict((p.name, p.default) for p in parameters if p.default is not p.empty)
+
+
+def _compile_serializers(cls, cls_name, fields, defaults, validate):
+    """
+    Generate the source code of the encode and decode functions of :cls and compile it,
+    so that they access each attribute directly, without any loops or reflection.
+    :return: (encode, decode) functions
+    """
+    encode_source = "def encode(obj):\n    return {%r: {%s}}\n" % (
+        cls_name, ", ".join("%r: obj.%s" % (field, field) for field in fields))
+    if validate:
+        decode_source = "def decode(dikt):\n    return cls(**dikt)\n"
+    else:
+        lines = ["def decode(dikt):", "    obj = cls.__new__(cls)"]
+        for field in fields:
+            if field in defaults:
+                lines.append("    obj.%s = dikt.get(%r, defaults[%r])" % (field, field, field))
+            else:
+                lines.append("    obj.%s = dikt[%r]" % (field, field))
+        lines.append("    return obj")
+        decode_source = "\n".join(lines) + "\n"
+
+    namespace = {'cls': cls, 'defaults': defaults}
+    exec(compile(encode_source + decode_source, "<serializers of %s>" % cls.__name__, "exec"), namespace)
+    return namespace['encode'], namespace['decode']
+
+
+def _check_attributes_once(cls, fields, encode):
+    """
+    :return: an encoder, which checks that the attributes of the first object it encodes are :fields.
+    After a successful check the encoder is replaced with :encode.
+    """
+    def encode_after_check(obj):
+        attributes = getattr(obj, '__dict__', None)
+        if attributes is not None and set(attributes) != set(fields):
+            raise ValueError(
+                "The attributes of {name} ({attributes}) differ from the parameters of its constructor ({fields}). "
+                "Pass fields= to make_class_serializable().".format(name=cls.__name__,
+                                                                   attributes=sorted(attributes),
+                                                                   fields=sorted(fields)))
+        _encoders[cls] = encode
+        return encode(obj)
+
+    return encode_after_check
+
+
+def _register_enum_encoder(enum_cls):
+    """
+    Called by make_enum_serialazable() for each enum class it registers
+    """
+    _encoders[enum_cls] = _encode_enum
 
 
 class CustomJsonEncoder(json.JSONEncoder):
@@ -26,65 +164,211 @@ class CustomJsonEncoder(json.JSONEncoder):
     """
 
     def default(self, obj):
-        # global _registered_serializable_classes
-        if type(obj) in _enum_classes().values():
-            return {"__enum__": str(obj)}
-        if type(obj) in _registered_serializable_classes:
-            return {_serialazable_cls_name(type(obj)): obj.__dict__}
-        if type(obj) is datetime:
-            return {"__datetime__": obj.isoformat()}
+        encoder = _encoders.get(type(obj))
+        if encoder is not None:
+            return encoder(obj)
         return json.JSONEncoder.default(self, obj)
 
 
 def deserialize_obj_hook(d):
-    global _registered_serializable_classes
+    """
+    object_hook for json.loads(), the counterpart of CustomJsonEncoder.
+    The objects CustomJsonEncoder produces have a single key - a tag - so the decoder is found with one lookup of the
+    tag in _decoders. Other dicts are returned (almost) as they are.
+    """
+    if len(d) == 1:
+        for tag, value in d.items():
+            decoder = _decoders.get(tag)
+            if decoder is not None:
+                # a dict value was already passed through this hook, because json.loads() decodes inner objects first
+                return decoder(value)
+    return d
 
-    d = convert_dict_to_str(d)
-    # see if the d has a serialized class that we manage (list could be empty!)
-    managed_classes_in_dikt = [cls for cls in _registered_serializable_classes if _serialazable_cls_name(cls) in d]
-
-    if "__enum__" in d:
-        name, member = d["__enum__"].split(".")
-        return getattr(_enum_classes()[name], member)
-    elif managed_classes_in_dikt:
-        assert len(managed_classes_in_dikt) is 1
-        managed_serializeable_klass = managed_classes_in_dikt[0]  # there should be only one class, so take it
-
-        dikt = d[_serialazable_cls_name(managed_serializeable_klass)]
-        # initialise an instance of the class and return it
-        return managed_serializeable_klass(**dikt)
-    elif "__datetime__" in d:
-        return dateutil.parser.parse(d['__datetime__']).replace(tzinfo=None)
-    else:
-        return d
+
+def iter_encode(objects, fp):
+    """
+    Write the objects as JSON lines - one json document, encoded with CustomJsonEncoder, per line.
+    The objects are written one at a time, so :objects can be a generator of any length and neither the list
+    of objects nor the whole json string has to be in memory.
+    :param objects: iterable of json-serializable objects
+    :param fp: a file-like object opened for writing text
+    :return: the number of written objects
+    """
+    # without indentation json never produces a newline - the ones in strings are escaped
+    encode = CustomJsonEncoder().encode
+    count = 0
+    for obj in objects:
+        fp.write(encode(obj))
+        fp.write("\n")
+        count += 1
+    return count
 
 
-def convert_dict_to_str(d):
+def iter_decode(fp):
     """
-    Needed for python 2 compatibility.
-    Python 2 has both str and unicode, python 3 has just str
-    :param d:
-    :return: d, but with all unicode converted to str, if under python 2
+    The counterpart of iter_encode()
+    :param fp: a file-like object opened for reading text, with one json document per line
+    :return: generator of the decoded objects. Empty lines are skipped.
+    """
+    decode = json.JSONDecoder(object_hook=deserialize_obj_hook).decode
+    for line in fp:
+        if line.strip():
+            yield decode(line)
+
+
+_epoch = datetime(1970, 1, 1)
+
+
+class ColumnarBatch(object):
+    """
+    A list of objects of one serializable class (e.g. the VenueMeasurementDetached objects of a cylinder),
+    which CustomJsonEncoder writes column by column instead of object by object:
+
+        {"__columnar__": {"class": "VenueMeasurementDetached", "length": 2, "fields": ["number_of_people", ...],
+                          "columns": [{"encoding": "plain", "data": [10, 12]}, ...]}}
+
+    so the tag and the names of the attributes are written once per batch. A column of naive datetimes is written
+    as epoch integers (seconds, or microseconds if any datetime has them) and a column of strings with repeated
+    values as a dictionary of the distinct strings and a code per object. Other columns are plain lists.
+
+    deserialize_obj_hook() returns a ColumnarBatch. The columns are decoded only when they are accessed - with
+    to_list() (or by iterating over the batch) as objects, with column() as a list of values of one attribute,
+    or with arrays() as numpy arrays, without creating any objects.
     """
-    import sys
-    if sys.version_info >= (3, 0):
-        # python 3 doesn't need any adjustments
-        return d
 
-    d_str = {}
-    for k, v in d.items():
-        # convert the keys and values from unicode to str (this is needed for Python2.7 compatibility)
-        k_str = k
-        v_str = v
-        if isinstance(k, unicode):
-            k_str = str(k)
-        if isinstance(v, unicode):
-            v_str = str(v)
+    def __init__(self, class_name, length, fields, columns):
+        """
+        Use from_objects() to create a batch.
+        :param class_name: the name of a class made serializable with make_class_serializable()
+        :param length: number of objects in the batch
+        :param fields: names of the attributes of the objects
+        :param columns: an encoded column (see _encode_column()) for each of :fields
+        """
+        self.class_name = class_name
+        self.length = length
+        self.fields = fields
+        self.columns = columns
+
+    @classmethod
+    def from_objects(cls, objects, object_class=None):
+        """
+        :param objects: sequence of objects of the same class, made serializable with make_class_serializable()
+        :param object_class: the class of the objects. Needed only if :objects is empty.
+        :raises ValueError - if the class of the objects isn't serializable, or the objects are of different classes
+        """
+        objects = list(objects)
+        object_class = object_class or (type(objects[0]) if objects else None)
+        if object_class not in _serializable_fields:
+            raise ValueError("%s isn't made serializable with make_class_serializable()" % object_class)
+        if any(type(obj) is not object_class for obj in objects):
+            raise ValueError("All objects of a ColumnarBatch should be of class %s" % object_class.__name__)
+        if objects:
+            # runs the check of the attributes of make_class_serializable(), if the class still has it
+            _encoders[object_class](objects[0])
+        fields = _serializable_fields[object_class]
+        columns = [_encode_column([getattr(obj, field) for obj in objects]) for field in fields]
+        return cls(object_class.__name__, len(objects), list(fields), columns)
+
+    def __len__(self):
+        return self.length
 
-        d_str[k_str] = v_str
+    def __iter__(self):
+        return iter(self.to_list())
 
-    return d_str
+    def column(self, field):
+        """
+        :return: list with the value of :field of each object
+        """
+        return _decode_column(self.columns[self.fields.index(field)])
+
+    def to_list(self):
+        """
+        :return: list of the objects in the batch
+        """
+        decode = _decoders[_serialazable_cls_name_of(self.class_name)]
+        values = [self.column(field) for field in self.fields]
+        fields = self.fields
+        return [decode(dict(zip(fields, row))) for row in zip(*values)] if fields else []
+
+    def arrays(self):
+        """
+        :return: dict with a numpy array for each field. Datetimes are datetime64 arrays.
+        """
+        import numpy as np
+        result = {}
+        for field, column in zip(self.fields, self.columns):
+            encoding = column['encoding']
+            if encoding == 'epoch_seconds':
+                result[field] = np.array(column['data'], dtype=np.int64).astype('datetime64[s]')
+            elif encoding == 'epoch_microseconds':
+                result[field] = np.array(column['data'], dtype=np.int64).astype('datetime64[us]')
+            elif encoding == 'dictionary':
+                result[field] = np.array(column['values'])[np.array(column['codes'], dtype=np.intp)]
+            else:
+                result[field] = np.array(column['data'])
+        return result
+
+
+def _encode_column(values):
+    """
+    :param values: list with the value of one attribute of each object of a ColumnarBatch
+    :return: dict with the encoding and the encoded values
+    """
+    if values and all(type(v) is datetime and v.tzinfo is None for v in values):
+        deltas = [v - _epoch for v in values]
+        if any(delta.microseconds for delta in deltas):
+            return {"encoding": "epoch_microseconds",
+                    "data": [(d.days * 86400 + d.seconds) * 1000000 + d.microseconds for d in deltas]}
+        return {"encoding": "epoch_seconds", "data": [d.days * 86400 + d.seconds for d in deltas]}
+
+    if values and all(isinstance(v, str) for v in values):
+        codes_by_value = {}
+        codes = [codes_by_value.setdefault(v, len(codes_by_value)) for v in values]
+        if len(codes_by_value) < len(values):
+            distinct = sorted(codes_by_value, key=codes_by_value.get)
+            return {"encoding": "dictionary", "values": distinct, "codes": codes}
+
+    return {"encoding": "plain", "data": values}
+
+
+def _decode_column(column):
+    encoding = column['encoding']
+    if encoding == 'epoch_seconds':
+        return [_epoch + timedelta(seconds=v) for v in column['data']]
+    if encoding == 'epoch_microseconds':
+        return [_epoch + timedelta(microseconds=v) for v in column['data']]
+    if encoding == 'dictionary':
+        values = column['values']
+        return [values[code] for code in column['codes']]
+    return column['data']
+
+
+def _encode_columnar_batch(batch):
+    return {"__columnar__": {"class": batch.class_name, "length": batch.length, "fields": batch.fields,
+                             "columns": batch.columns}}
+
+
+def _decode_columnar_batch(value):
+    return ColumnarBatch(value['class'], value['length'], value['fields'], value['columns'])
+
+
+_encoders[ColumnarBatch] = _encode_columnar_batch
+_decoders["__columnar__"] = _decode_columnar_batch
+
+
+def convert_dict_to_str(d):
+    """
+    Was needed for python 2 compatibility (python 2 has both str and unicode, python 3 has just str).
+    Python 2 isn't supported anymore - kept for the code which still calls it.
+    :param d:
+    :return: d
+    """
+    return d
 
 
 def _serialazable_cls_name(cls):
-    return "__%s__" % cls.__name__
+    return _serialazable_cls_name_of(cls.__name__)
+
+
+def _serialazable_cls_name_of(name):
+    return "__%s__" % name
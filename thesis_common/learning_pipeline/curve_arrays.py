@@ -0,0 +1,360 @@
+"""
+Array based (numpy) counterparts of the calculations in curve_calculations.py.
+Here a curve is two float arrays of the same length - the x values (epoch seconds) and the y values, sorted by x.
+Between two consecutive points a curve is linear, the same as the Line objects of the object based calculations.
+A curve can repeat an x value (e.g. naive local times in the hour which repeats when DST ends). There it jumps from
+the y of the first point with that x to the y of the last one.
+"""
+import time
+from datetime import datetime, timedelta
+from functools import lru_cache
+import numpy as np
+
+_epoch = datetime(1970, 1, 1)
+# UTC offsets change at a multiple of 15 minutes (e.g. 02:00 -> 02:30 in Australia/Lord_Howe)
+_offset_slot_seconds = 15 * 60
+
+
+class Curve(object):
+    """
+    A curve stored in two contiguous float64 arrays - x (epoch seconds) and y, sorted by x.
+    Takes a fraction of the memory of a list of DatePoint objects and is accepted by every CurveDiffCalculator engine.
+    The x values are the same as the ones of DatePoint objects with the same datetimes.
+    """
+    __slots__ = ('x', 'y')
+
+    def __init__(self, x, y):
+        """
+        :param x: array-like of numbers (epoch seconds)
+        :param y: array-like of numbers, same length as :x
+        :raises ValueError - if x and y have different lengths
+        """
+        self.x, self.y = curve_to_arrays((x, y))
+
+    @classmethod
+    def from_datetimes(cls, datetimes, values):
+        """
+        :param datetimes: sequence of naive datetime objects
+        :param values: sequence of numbers, same length as :datetimes
+        """
+        return cls(datetimes_to_epoch_seconds(datetimes), values)
+
+    @classmethod
+    def from_venue_measurements(cls, venue_measurements):
+        """
+        :param venue_measurements: iterable of objects with `datetime` and `label` properties,
+        e.g. VenueMeasurementDetached
+        """
+        datetimes = []
+        values = []
+        for vm in venue_measurements:
+            datetimes.append(vm.datetime)
+            values.append(vm.label)
+        return cls.from_datetimes(datetimes, values)
+
+    @classmethod
+    def from_points(cls, points):
+        """
+        :param points: sequence of Point/DatePoint objects
+        """
+        return cls(*curve_to_arrays(points))
+
+    def __len__(self):
+        return self.x.size
+
+    def __getstate__(self):
+        return self.x, self.y
+
+    def __setstate__(self, state):
+        self.x, self.y = state
+
+
+def datetimes_to_epoch_seconds(datetimes):
+    """
+    Bulk version of time.mktime(datetime_object.timetuple()), which is what DatePoint uses.
+    numpy converts the naive datetimes as if they were UTC, then each value is shifted with the UTC offset of
+    the local timezone. The offset is looked up with time.mktime() once per distinct 15 minutes (the UTC offsets
+    change at a multiple of 15 minutes), instead of once per datetime.
+    :param datetimes: sequence of naive datetime objects
+    :return: float64 array
+    """
+    datetimes = list(datetimes)
+    if not datetimes:
+        return np.empty(0, dtype=np.float64)
+    # timetuple() drops the microseconds, so do we
+    naive_seconds = np.array(datetimes, dtype='datetime64[us]').astype(np.int64) // 1000000
+    slots, slot_of_each = np.unique(naive_seconds // _offset_slot_seconds, return_inverse=True)
+    offsets = np.array([time.mktime((_epoch + timedelta(seconds=int(slot) * _offset_slot_seconds)).timetuple()) -
+                        float(slot * _offset_slot_seconds) for slot in slots])
+    return naive_seconds.astype(np.float64) + offsets[slot_of_each.ravel()]
+
+
+def curve_to_arrays(curve):
+    """
+    Convert a curve to a pair of numpy arrays.
+    :param curve: a Curve, a list of Point/DatePoint objects or a (x, y) tuple of array-likes
+    :return: (x, y) tuple of float64 arrays, sorted by x
+    :raises ValueError - if x and y have different lengths
+    """
+    if isinstance(curve, Curve):
+        return curve.x, curve.y
+    if is_array_curve(curve):
+        x = np.ascontiguousarray(curve[0], dtype=np.float64)
+        y = np.ascontiguousarray(curve[1], dtype=np.float64)
+    else:
+        x = np.fromiter((p.x for p in curve), dtype=np.float64, count=len(curve))
+        y = np.fromiter((p.y for p in curve), dtype=np.float64, count=len(curve))
+    if x.shape != y.shape or x.ndim != 1:
+        raise ValueError("x and y of a curve should be one dimensional and of the same length. "
+                         "x: {x_shape} y: {y_shape}".format(x_shape=x.shape, y_shape=y.shape))
+    if x.size > 1 and np.any(x[1:] < x[:-1]):
+        order = np.argsort(x, kind='stable')
+        x, y = x[order], y[order]
+    return x, y
+
+
+def is_array_curve(curve):
+    """
+    :return: True if :curve is a (x, y) pair of array-likes and not a sequence of points
+    """
+    return isinstance(curve, tuple) and len(curve) == 2 and not hasattr(curve[0], 'x')
+
+
+def merge_grids(x1, x2):
+    """
+    Merge the x values of two curves into one grid, restricted to the x-range both curves cover.
+    Both inputs are sorted, so the stable sort only merges two sorted runs - O(n+m).
+    :param x1: sorted array
+    :param x2: sorted array
+    :return: sorted array with the unique x values of both curves within the overlap of the two curves.
+    An x value which one of the curves repeats is in the grid twice - an interval of width zero, over which that curve
+    jumps (see interp_curve()).
+    Empty if the curves don't overlap.
+    """
+    overlap = overlap_of(x1, x2)
+    if overlap is None:
+        return np.empty(0, dtype=np.float64)
+    lo, hi = overlap
+    grid = np.concatenate((x1, x2))
+    grid.sort(kind='stable')
+    grid = grid[(grid >= lo) & (grid <= hi)]
+    if grid.size:
+        unique = np.empty(grid.shape, dtype=bool)
+        unique[0] = True
+        np.not_equal(grid[1:], grid[:-1], out=unique[1:])
+        grid = grid[unique]
+        jumps = np.concatenate((repeated_values(x1), repeated_values(x2)))
+        if jumps.size:
+            grid = np.repeat(grid, np.where(np.isin(grid, jumps), 2, 1))
+    return grid
+
+
+def repeated_values(x):
+    """
+    :param x: sorted array
+    :return: array with the values which are more than once in :x (as often as they are repeated)
+    """
+    return x[1:][x[1:] == x[:-1]]
+
+
+def interp_curve(grid, x, y):
+    """
+    np.interp() which follows the jumps of a curve which repeats x values.
+    At a value which is twice in :grid (see merge_grids()) the first copy gets the y of the first point of the curve
+    with that x and the second copy the y of the last one. Elsewhere a jump is taken to happen just before its x.
+    :param grid: sorted array
+    :param x: sorted array, the x values of the curve
+    :param y: array, the y values of the curve
+    :return: array with the values of the curve at :grid
+    """
+    if not repeated_values(x).size:
+        return np.interp(grid, x, y)
+    values = _interp_side(grid, x, y, side='right')
+    before_jump = np.zeros(grid.shape, dtype=bool)
+    np.equal(grid[1:], grid[:-1], out=before_jump[:-1])
+    values[before_jump] = _interp_side(grid[before_jump], x, y, side='left')
+    return values
+
+
+def _interp_side(grid, x, y, side):
+    """
+    The value of a curve at each value of :grid, from the points left of it (side='left') or right of it
+    (side='right'). These differ only where the curve jumps.
+    """
+    if side == 'right':
+        # interpolate from the last point with x <= grid value
+        first = np.clip(np.searchsorted(x, grid, side='right') - 1, 0, x.size - 1)
+        second = np.minimum(first + 1, x.size - 1)
+    else:
+        # interpolate to the first point with x >= grid value
+        second = np.clip(np.searchsorted(x, grid, side='left'), 0, x.size - 1)
+        first = np.maximum(second - 1, 0)
+    widths = x[second] - x[first]
+    weights = np.divide(grid - x[first], widths, out=np.zeros(grid.shape), where=widths > 0)
+    np.clip(weights, 0.0, 1.0, out=weights)
+    return y[first] + weights * (y[second] - y[first])
+
+
+def area_between(grid, diff):
+    """
+    The exact area between two piecewise linear curves.
+    On each interval of the grid the difference between the curves is linear. If it doesn't change its sign,
+    the area is a trapezoid, otherwise two triangles which meet where the curves intersect.
+    :param grid: sorted array of the x values at which :diff is known. it must include all x values of both curves.
+    :param diff: curve1 - curve2 evaluated at :grid. The last axis should match :grid, so a 2d array
+    gives the area for each row.
+    :return: the area (a float, or an array with one area per row)
+    """
+    widths = np.diff(grid)
+    d0 = diff[..., :-1]
+    d1 = diff[..., 1:]
+    abs0 = np.abs(d0)
+    abs1 = np.abs(d1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        triangles = (d0 * d0 + d1 * d1) / (2.0 * (abs0 + abs1))
+    areas = np.where(d0 * d1 >= 0, (abs0 + abs1) * 0.5, triangles)
+    return (areas * widths).sum(axis=-1)
+
+
+def area_between_curves(x1, y1, x2, y2):
+    """
+    Integrate |curve1 - curve2| over the x-range both curves cover in O(n+m).
+    :params: sorted arrays, see curve_to_arrays()
+    :return: float
+    """
+    grid = merge_grids(x1, x2)
+    if grid.size < 2:
+        return 0.0
+    diff = interp_curve(grid, x1, y1) - interp_curve(grid, x2, y2)
+    return float(area_between(grid, diff))
+
+
+def interp_rows(grid, x, ys):
+    """
+    Like interp_curve(), but for many curves which share the same x values.
+    The position of each grid value within :x is searched only once for all curves.
+    :param grid: sorted array, within the range of :x
+    :param x: sorted array with the shared x values of the curves
+    :param ys: 2d array, a row with the y values for each curve
+    :return: 2d array, a row with the values at :grid for each curve
+    """
+    if repeated_values(x).size:
+        return np.vstack([interp_curve(grid, x, y) for y in ys])
+    if x.size == 1:
+        return np.repeat(ys[:, :1], grid.size, axis=1)
+    idx = np.clip(np.searchsorted(x, grid, side='right') - 1, 0, x.size - 2)
+    weights = (grid - x[idx]) / (x[idx + 1] - x[idx])
+    left = ys[:, idx]
+    return left + weights * (ys[:, idx + 1] - left)
+
+
+def overlap_of(x1, x2):
+    """
+    :param x1: sorted array
+    :param x2: sorted array
+    :return: (start, end) of the x-range both curves cover, None if they don't overlap
+    """
+    if x1.size == 0 or x2.size == 0:
+        return None
+    start = max(x1[0], x2[0])
+    end = min(x1[-1], x2[-1])
+    if start > end:
+        return None
+    return start, end
+
+
+def clip(x, y, start, end):
+    """
+    Cut a curve to [start, end]. The values at :start and :end are interpolated, so the result begins and ends
+    exactly there. If the curve jumps at :start or :end, the result starts after the jump and ends before it.
+    :param x: sorted array, which covers [start, end]
+    :param y: array
+    :return: (x, y) tuple of arrays
+    """
+    inside = (x > start) & (x < end)
+    ends = np.concatenate((_interp_side(np.array([start]), x, y, side='right'),
+                           _interp_side(np.array([end]), x, y, side='left')))
+    clipped_x = np.concatenate(([start], x[inside], [end]))
+    clipped_y = np.concatenate((ends[:1], y[inside], ends[1:]))
+    if start == end:
+        return clipped_x[:1], clipped_y[:1]
+    return clipped_x, clipped_y
+
+
+@lru_cache(maxsize=256)
+def regular_grid(start, step, length):
+    """
+    [start, start + step, ..., start + (length - 1) * step]
+    The grids are cached, so comparing many curves over the same period creates the grid only once.
+    The returned array is read-only, because it is shared between the callers.
+    """
+    grid = start + step * np.arange(length, dtype=np.float64)
+    grid.flags.writeable = False
+    return grid
+
+
+def align_curves(curve1, curve2, step=None):
+    """
+    Resample two curves onto a common grid within the x-range both of them cover.
+    :param curve1: a Curve, a list of points or a (x, y) tuple of arrays
+    :param curve2: a Curve, a list of points or a (x, y) tuple of arrays
+    :param step: the distance between the x values of the grid (e.g. 60 for minutes). If None, the grid is
+    the union of the x values of both curves, which keeps the curves exact.
+    With a step the grid is a (cached) regular_grid() starting at the beginning of the overlap, and ends at the
+    last step within the overlap.
+    :return: (grid, y1, y2) tuple of arrays - the values of both curves at the grid
+    :raises ValueError - if the curves don't overlap
+    """
+    x1, y1 = curve_to_arrays(curve1)
+    x2, y2 = curve_to_arrays(curve2)
+    overlap = overlap_of(x1, x2)
+    if overlap is None:
+        raise ValueError("The curves don't overlap")
+    if step is None:
+        grid = merge_grids(x1, x2)
+    else:
+        start, end = overlap
+        grid = regular_grid(float(start), float(step), int((end - start) // step) + 1)
+    return grid, interp_curve(grid, x1, y1), interp_curve(grid, x2, y2)
+
+
+def simplify(x, y, max_error):
+    """
+    Ramer-Douglas-Peucker simplification with a vertical error: drop points as long as no dropped point is further
+    than :max_error (in y) from the simplified curve. Since both curves are linear between the points of the original
+    curve, the simplified curve is within :max_error of the original one everywhere.
+    The distances of all points between two kept points are calculated at once with numpy.
+    The first and the last point are always kept, so the x-range of the curve doesn't change.
+    :param x: sorted array
+    :param y: array
+    :param max_error: the max vertical distance between the original and the simplified curve
+    :return: (x, y) tuple of arrays with the kept points
+    """
+    if x.size < 3:
+        return x, y
+    keep = np.zeros(x.size, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, x.size - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        inner_x = x[first + 1:last]
+        chord = y[first] + (y[last] - y[first]) * (inner_x - x[first]) / (x[last] - x[first])
+        errors = np.abs(y[first + 1:last] - chord)
+        worst = int(np.argmax(errors))
+        if errors[worst] > max_error:
+            worst += first + 1
+            keep[worst] = True
+            stack.append((first, worst))
+            stack.append((worst, last))
+    return x[keep], y[keep]
+
+
+def simplify_curve(curve, max_error):
+    """
+    See simplify()
+    :param curve: a Curve, a list of points or a (x, y) tuple of arrays
+    :return: Curve
+    """
+    return Curve(*simplify(*curve_to_arrays(curve), max_error=max_error))
@@ -1,6 +1,12 @@
 import math
 import time
+from bisect import bisect_left, bisect_right
+from collections import deque
 from datetime import datetime
+import numpy as np
+from .curve_arrays import Curve, curve_to_arrays, area_between_curves, is_array_curve, merge_grids, area_between, \
+    interp_curve, interp_rows, overlap_of, clip, simplify_curve
+from .enums import CurveDiffEngine, CurveMetric
 
 
 class CurveDiffCalculator(object):
@@ -9,15 +15,22 @@ class CurveDiffCalculator(object):
     Relative to a max value.
     """
 
-    def __init__(self, curve1, curve2, max):
+    def __init__(self, curve1, curve2, max, engine=CurveDiffEngine.polygon, simplification_error=None):
         """
-        :param curve1: a list of points
-        :param curve2: a list of points
+        :param curve1: a list of points, a Curve or a (x, y) tuple of arrays
+        :param curve2: a list of points, a Curve or a (x, y) tuple of arrays
         :param max: the max to which the relative difference will be compared
+        :param engine: CurveDiffEngine used by get_relative_difference()
+        :param simplification_error: if set, get_relative_difference() first simplifies both curves, so that they
+        are within this (vertical) distance of the original ones. See curve_arrays.simplify().
+        Trades accuracy for speed, see get_relative_difference_error_bound().
         """
         self.curve1 = curve1
         self.curve2 = curve2
         self.max = max
+        self.engine = engine
+        self.simplification_error = simplification_error
+        self._total_area = None
 
     def get_relative_difference(self):
         """
@@ -26,83 +39,163 @@ class CurveDiffCalculator(object):
         divided by the total area
         :return: the difference expressed in percentage
         """
-        self.curve1 = sorted(self.curve1)
-        self.curve2 = sorted(self.curve2)
-        l = self.curve1[-1].datetime - self.curve1[0].datetime
-        #assert l != 0, "this curve has len zero"
-        try:
-            assert l == self.curve2[-1].datetime - self.curve2[0].datetime
-        except:
-            pass
+        total_area = self.get_total_area()
+        if self.simplification_error:
+            self.curve1 = simplify_curve(self.curve1, self.simplification_error)
+            self.curve2 = simplify_curve(self.curve2, self.simplification_error)
+        if self.engine is CurveDiffEngine.numpy:
+            return self._get_relative_difference_numpy(total_area)
+
+        # sorted by x only, so that points with the same x (a vertical line) keep their order.
+        # sorted(points) would reverse them, because Point.__lt__ is <=
+        self.curve1 = sorted(curve_to_points(self.curve1), key=lambda p: p.x)
+        self.curve2 = sorted(curve_to_points(self.curve2), key=lambda p: p.x)
+        x1 = [self.curve1[0].x, self.curve1[-1].x]
+        x2 = [self.curve2[0].x, self.curve2[-1].x]
+        if x1 != x2:
+            # the curves span different x-ranges, compare them only where both are defined
+            start, end = overlap_of(np.array(x1), np.array(x2))
+            self.curve1 = curve_to_points(clip(*curve_to_arrays(self.curve1), start=start, end=end))
+            self.curve2 = curve_to_points(clip(*curve_to_arrays(self.curve2), start=start, end=end))
         polygon_area = sum([x.area for x in self.get_polygons()])
-        total_area = self.max * l.total_seconds()
-        return polygon_area / float(total_area)
+        return polygon_area / total_area
 
-    def get_intersections(self):
+    def get_total_area(self):
         """
-        Calculate the intersections of the curves
-        :return:
+        max * the length of the x-range over which the curves are compared (see comparison_duration_in_seconds()).
+        Measured on the curves as they were passed - get_relative_difference() replaces them with simplified or clipped
+        curves, which no longer have the datetimes of DatePoints.
+        :return: float
+        :raises ValueError - if the curves don't overlap
         """
-        intersections = []
-        for i in range(1, len(self.curve1)):
-            line1 = Line(self.curve1[i - 1], self.curve1[i])
-            other_lines = self._get_lines_between(curve=self.curve2, point1=self.curve1[i - 1], point2=self.curve1[i])
-            for line2 in other_lines:
-                intersection_point = line1.get_intersection_point(line2)
-                if intersection_point is not None and line1.within_x_range(intersection_point) and line2.within_x_range(
-                        intersection_point):
-                    intersections.append(intersection_point)
-                    break
-        return sorted(list(set(intersections)))
-
-    def _get_lines_between(self, curve, point1, point2):
-        """
-        :precondition: the curve needs to be sorted
-        :param point1:
-        :param point2:
-        :return:
+        if self._total_area is None:
+            x1 = curve_to_arrays(self.curve1)[0]
+            x2 = curve_to_arrays(self.curve2)[0]
+            self._total_area = float(self.max * comparison_duration_in_seconds(self.curve1, x1, x2))
+        return self._total_area
+
+    def exceeds(self, threshold, first_chunk_size=64):
         """
-        lines = []
-        # The next code is not done with a list comprehension for optimization
-        points = []
-        for p in curve:
-            if point1 <= p <= point2:
-                points.append(p)
-            elif p > point2:
-                break
-        if len(points) != 0:
-            index_first_point = curve.index(points[0])
-            index_last_point = curve.index(points[-1])
-            # adding the previous point:
-            if index_first_point > 0:
-                points.append(curve[index_first_point - 1])
-            # adding the last point
-            if index_last_point < len(curve) - 1:
-                points.append(curve[index_last_point + 1])
-        else:
-            """
-            The current line lays completely within the range of another line.
-            Therefor no points are found, so we search this absorbing line.
-            """
-            points = self._find_absorbing_line(curve, point1, point2)
-        assert len(points) > 1
-        points = sorted(points)
-        for i in range(1, len(points)):
-            lines.append(Line(points[i - 1], points[i]))
-        return lines
+        Checks whether the relative difference is bigger than :threshold, without calculating all of it when it is.
+        The area between the curves is accumulated from left to right, in chunks of curve1 points which double in size,
+        and the calculation stops as soon as the area crosses threshold * max * duration.
+        Always uses the numpy engine.
+        :param threshold: relative difference, e.g. 0.1
+        :param first_chunk_size: number of curve1 points in the first chunk
+        :return: (exceeds, relative_difference) tuple. If exceeds is True, relative_difference is a lower bound -
+        the relative difference of the part of the curves compared so far. Otherwise it's the exact value.
+        """
+        x1, y1 = curve_to_arrays(self.curve1)
+        x2, y2 = curve_to_arrays(self.curve2)
+        total_area = self.get_total_area()
+        area_limit = threshold * total_area
+        start, end = overlap_of(x1, x2)
 
-    @staticmethod
-    def _find_absorbing_line(curve, point1, point2):
+        area = 0.0
+        chunk_size = first_chunk_size
+        chunk_start = start
+        while chunk_start < end:
+            next_idx = np.searchsorted(x1, chunk_start, side='right')
+            chunk_end = min(end, x1[min(next_idx + chunk_size - 1, x1.size - 1)])
+            # the points of each curve within the chunk, and one more on each side to interpolate the chunk ends
+            chunk1 = clip(*_chunk_of(x1, y1, chunk_start, chunk_end), start=chunk_start, end=chunk_end)
+            chunk2 = clip(*_chunk_of(x2, y2, chunk_start, chunk_end), start=chunk_start, end=chunk_end)
+            area += area_between_curves(*(chunk1 + chunk2))
+            if area > area_limit:
+                return True, area / total_area
+            chunk_start = chunk_end
+            chunk_size *= 2
+        return False, area / total_area
+
+    def get_relative_difference_error_bound(self):
+        """
+        How much the result of get_relative_difference() can differ from the one with the original curves,
+        because of simplification_error. Each simplified curve is within simplification_error of its original, so the
+        area between them changes by at most 2 * simplification_error * duration.
+        :return: the bound, expressed in percentage (0 without simplification)
+        """
+        if not self.simplification_error:
+            return 0.0
+        return 2.0 * self.simplification_error / float(self.max)
+
+    def _get_relative_difference_numpy(self, total_area):
+        """
+        Same result as the polygon engine, but the area between the curves is integrated over numpy arrays
+        in O(n+m), without creating any Line/Polygon objects.
+        :param total_area: see get_total_area()
+        """
+        x1, y1 = curve_to_arrays(self.curve1)
+        x2, y2 = curve_to_arrays(self.curve2)
+        return area_between_curves(x1, y1, x2, y2) / total_area
+
+    def get_intersections(self):
+        """
+        Calculate the intersections of the curves.
+        :precondition: the curves need to be sorted
+
+        Both curves are swept at once from left to right with a pointer to the current line of each curve,
+        so every line is visited once - O(n+m). At each step we take the x-range covered by both current lines.
+        The difference between the lines is linear within this range, so the curves cross in it iff the difference
+        changes sign between the two ends of the range.
+        Points where the curves touch are intersections too, except the inner points of a range where the curves
+        overlap (collinear lines) - there only the start and the end of the overlap are intersections.
+        A vertical line (two points with the same x) is a range of width zero, from the y of its first point to the
+        y of its second one, so the curves can cross on it too.
+        :return: sorted list of Point objects
+        """
+        self.curve1 = curve_to_points(self.curve1)
+        self.curve2 = curve_to_points(self.curve2)
+        curve1, curve2 = self.curve1, self.curve2
+        # (x, y, difference between the curves at x) for every x where the difference is known.
+        # at a vertical line there is more than one sample with the same x
+        samples = []
+
+        def add_sample(x, y, diff, vertical=False):
+            if not samples or samples[-1][0] != x or (vertical and samples[-1][2] != diff):
+                samples.append((x, y, diff))
+
+        i, j = 1, 1
+        while i < len(curve1) and j < len(curve2):
+            a0, a1 = curve1[i - 1], curve1[i]
+            b0, b1 = curve2[j - 1], curve2[j]
+            x_from = max(a0.x, b0.x)
+            x_to = min(a1.x, b1.x)
+            if x_from <= x_to:
+                vertical = a0.x == a1.x or b0.x == b1.x
+                y_from, y_to = _ys_on_line(a0, a1, x_from, x_to)
+                other_from, other_to = _ys_on_line(b0, b1, x_from, x_to)
+                diff_from = y_from - other_from
+                diff_to = y_to - other_to
+                add_sample(x_from, y_from, diff_from, vertical)
+                if diff_from * diff_to < 0:
+                    share = diff_from / float(diff_from - diff_to)
+                    add_sample(x_from + (x_to - x_from) * share, y_from + (y_to - y_from) * share, 0, vertical)
+                add_sample(x_to, y_to, diff_to, vertical)
+            # move to the next line of the curve whose current line ends first
+            if a1.x < b1.x:
+                i += 1
+            elif b1.x < a1.x:
+                j += 1
+            else:
+                i += 1
+                j += 1
 
-        for i in range(1, len(curve)):
-            if curve[i - 1] <= point1 and point2 <= curve[i]:
-                return [curve[i - 1], curve[i]]
-        raise ValueError("Some wrong points or curve was supplied")
+        intersections = []
+        for k, (x, y, diff) in enumerate(samples):
+            if diff != 0:
+                continue
+            overlap_before = k > 0 and samples[k - 1][2] == 0
+            overlap_after = k < len(samples) - 1 and samples[k + 1][2] == 0
+            if not (overlap_before and overlap_after):
+                intersections.append(Point(x, y))
+        return intersections
 
     def get_polygons(self):
         """
         It calculates all the different polygons created by the curves.
-        If there are no intersections one polygon is given back
+        If there are no intersections one polygon is given back.
+        The corners of each polygon are already in order - along curve1 forward and then along curve2 backward,
+        so the polygons don't need to sort them (see Polygon.__init__()).
         :return:
         """
         polygons = []
@@ -110,35 +203,480 @@ class CurveDiffCalculator(object):
 
         # If there were no intersections
         if len(intersections) == 0:
-            polygons.append(Polygon(self.curve1 + self.curve2))
+            polygons.append(Polygon(self.curve1 + self.curve2[::-1], ordered=True))
             return polygons
 
+        index1 = SortedCurveIndex(self.curve1)
+        index2 = SortedCurveIndex(self.curve2)
+
         # Everything except the edge cases
         for i in range(1, len(intersections)):
-            line = Line(intersections[i - 1], intersections[i])
-            corners1 = [p for p in self.curve1 if line.within_x_range(p)]
-            corners2 = [p for p in self.curve2 if line.within_x_range(p)]
-            corners = [intersections[i - 1]] + corners1 + [intersections[i]] + corners2
-            polygons.append(Polygon(corners))
+            x_from, x_to = intersections[i - 1].x, intersections[i].x
+            corners1 = index1.points_between(x_from, x_to)
+            corners2 = index2.points_between(x_from, x_to)
+            corners = [intersections[i - 1]] + corners1 + [intersections[i]] + corners2[::-1]
+            polygons.append(Polygon(corners, ordered=True))
 
         # Edge case: points before first intersection
-        corners1 = [p for p in self.curve1 if p <= intersections[0]]
-        corners2 = [p for p in self.curve2 if p <= intersections[0]]
-        corners = corners1 + [intersections[0]] + corners2
+        corners1 = index1.points_up_to(intersections[0].x)
+        corners2 = index2.points_up_to(intersections[0].x)
+        corners = corners1 + [intersections[0]] + corners2[::-1]
         if len(corners) > 1:
-            polygons.append(Polygon(corners))
+            polygons.append(Polygon(corners, ordered=True))
 
         # Edge case: points after last intersection
-        corners1 = [p for p in self.curve1 if p >= intersections[-1]]
-        corners2 = [p for p in self.curve2 if p >= intersections[-1]]
-        corners = corners1 + [intersections[-1]] + corners2
+        corners1 = index1.points_from(intersections[-1].x)
+        corners2 = index2.points_from(intersections[-1].x)
+        corners = [intersections[-1]] + corners1 + corners2[::-1]
         if len(corners) > 1:
-            polygons.append(Polygon(corners))
+            polygons.append(Polygon(corners, ordered=True))
 
         return polygons
 
 
+class CurveEvaluation(object):
+    """
+    The result of CurveEvaluator.evaluate(). Metrics which were not requested are None.
+    """
+
+    def __init__(self, relative_difference=None, mae=None, rmse=None, max_error=None, bias=None):
+        self.relative_difference = relative_difference
+        self.mae = mae
+        self.rmse = rmse
+        self.max_error = max_error
+        self.bias = bias
+
+
+class CurveEvaluator(object):
+    """
+    Calculates several error metrics of curve2 against curve1 (see CurveMetric).
+    The curves are aligned once - interpolated on their merged x-grid - and every metric is then
+    a vectorized expression over the difference between the curves at the ends of each grid interval.
+    To add a metric, add a member to CurveMetric, an attribute to CurveEvaluation and a function to _metric_functions.
+    """
+
+    def __init__(self, curve1, curve2, max, metrics=tuple(CurveMetric)):
+        """
+        :param curve1: a list of points, a Curve or a (x, y) tuple of arrays. e.g. the ground truth
+        :param curve2: a list of points, a Curve or a (x, y) tuple of arrays. e.g. the predictions
+        :param max: the max to which the relative difference will be compared
+        :param metrics: iterable of CurveMetric to calculate
+        """
+        self.curve1 = curve1
+        self.curve2 = curve2
+        self.max = max
+        self.metrics = list(metrics)
+
+    def evaluate(self):
+        """
+        :return: CurveEvaluation
+        :raises ValueError - if the curves don't overlap, or overlap in a single point
+        """
+        x1, y1 = curve_to_arrays(self.curve1)
+        x2, y2 = curve_to_arrays(self.curve2)
+        total_area = self.max * comparison_duration_in_seconds(self.curve1, x1, x2)
+        grid = merge_grids(x1, x2)
+        diff = interp_curve(grid, x1, y1) - interp_curve(grid, x2, y2)
+        aligned = _AlignedCurves(grid, diff, total_area=total_area)
+
+        result = CurveEvaluation()
+        for metric in self.metrics:
+            setattr(result, metric.name, _metric_functions[metric](aligned))
+        return result
+
+
+class _AlignedCurves(object):
+    """
+    The difference between two curves on their merged grid, shared by the functions in _metric_functions.
+    The curves overlap (see CurveEvaluator.evaluate()), so the grid has at least two values.
+    """
+
+    def __init__(self, grid, diff, total_area):
+        self.grid = grid
+        self.diff = diff
+        self.widths = np.diff(grid)
+        self.length = float(grid[-1] - grid[0])
+        self.total_area = float(total_area)
+        self._area = None
+
+    @property
+    def area(self):
+        """
+        The area between the curves. Cached, because more than one metric needs it.
+        """
+        if self._area is None:
+            self._area = float(area_between(self.grid, self.diff))
+        return self._area
+
+    def mean(self, integral):
+        return integral / self.length
+
+
+def _relative_difference(aligned):
+    return aligned.area / aligned.total_area
+
+
+def _mae(aligned):
+    return aligned.mean(aligned.area)
+
+
+def _rmse(aligned):
+    # the difference is linear within an interval, so the integral of its square is w * (d0^2 + d0*d1 + d1^2) / 3
+    d0 = aligned.diff[:-1]
+    d1 = aligned.diff[1:]
+    return math.sqrt(aligned.mean(float(np.sum(aligned.widths * (d0 * d0 + d0 * d1 + d1 * d1))) / 3.0))
+
+
+def _max_error(aligned):
+    return float(np.max(np.abs(aligned.diff)))
+
+
+def _bias(aligned):
+    return aligned.mean(float(np.sum(aligned.widths * (aligned.diff[:-1] + aligned.diff[1:]))) / 2.0)
+
+
+_metric_functions = {
+    CurveMetric.relative_difference: _relative_difference,
+    CurveMetric.mae: _mae,
+    CurveMetric.rmse: _rmse,
+    CurveMetric.max_error: _max_error,
+    CurveMetric.bias: _bias,
+}
+
+
+class SortedCurveIndex(object):
+    """
+    Answers "which points of the curve have x in [a, b]" in O(log n + number of points returned),
+    with a binary search over the x values of the sorted curve.
+    """
+    __slots__ = ('points', 'xs')
+
+    def __init__(self, curve):
+        """
+        :param curve: a list of points. It is sorted by x, if it isn't already.
+        """
+        xs = [p.x for p in curve]
+        if any(xs[i] > xs[i + 1] for i in range(len(xs) - 1)):
+            curve = sorted(curve, key=lambda p: p.x)
+            xs = [p.x for p in curve]
+        self.points = curve
+        self.xs = xs
+
+    def points_between(self, x_from, x_to):
+        """
+        :return: list of the points with x_from <= x <= x_to
+        """
+        return self.points[bisect_left(self.xs, x_from):bisect_right(self.xs, x_to)]
+
+    def points_up_to(self, x):
+        """
+        :return: list of the points with x <= :x
+        """
+        return self.points[:bisect_right(self.xs, x)]
+
+    def points_from(self, x):
+        """
+        :return: list of the points with x >= :x
+        """
+        return self.points[bisect_left(self.xs, x):]
+
+
+class ReferenceCurveDiffCalculator(object):
+    """
+    Calculate the relative difference between one reference curve (e.g. the ground truth) and many candidate curves
+    (e.g. the predictions of different models). The reference curve is sorted and converted to arrays only once.
+    The result for each candidate is the same as the one of
+    CurveDiffCalculator(reference_curve, candidate, max, engine=CurveDiffEngine.numpy).get_relative_difference()
+    """
+
+    def __init__(self, reference_curve, max):
+        """
+        :param reference_curve: a list of points, a Curve or a (x, y) tuple of arrays
+        :param max: the max to which the relative difference will be compared
+        """
+        self.x, self.y = curve_to_arrays(reference_curve)
+        self.max = max
+        self.total_area = float(self.max * curve_duration_in_seconds(reference_curve, self.x))
+
+    def _total_area(self, x):
+        """
+        :param x: the sorted x values of a candidate
+        :return: the total area for a candidate. The same as self.total_area, unless the candidate doesn't cover
+        the whole reference curve
+        """
+        if x.size and x[0] <= self.x[0] and x[-1] >= self.x[-1]:
+            return self.total_area
+        return float(self.max * comparison_duration_in_seconds((self.x, self.y), self.x, x))
+
+    def get_relative_difference(self, candidate):
+        """
+        :param candidate: a list of points, a Curve or a (x, y) tuple of arrays
+        :return: the relative difference between the reference curve and :candidate
+        """
+        x, y = curve_to_arrays(candidate)
+        return area_between_curves(self.x, self.y, x, y) / self._total_area(x)
+
+    def get_relative_differences(self, candidates):
+        """
+        :param candidates: iterable of curves (lists of points, Curves or (x, y) tuples of arrays)
+        :return: numpy array with the relative difference of each candidate, in the order of :candidates.
+        If all candidates have the same x values, they are compared at once with get_relative_differences_on_grid()
+        """
+        arrays = [curve_to_arrays(candidate) for candidate in candidates]
+        if not arrays:
+            return np.empty(0, dtype=np.float64)
+        shared_x = arrays[0][0]
+        if all(np.array_equal(x, shared_x) for x, _ in arrays[1:]):
+            return self.get_relative_differences_on_grid(shared_x, np.vstack([y for _, y in arrays]))
+        return np.array([area_between_curves(self.x, self.y, x, y) / self._total_area(x) for x, y in arrays])
+
+    def get_relative_differences_on_grid(self, x, ys):
+        """
+        Vectorized comparison of candidates which share the same x values (e.g. predictions for the same timestamps).
+        :param x: array-like with the x values shared by all candidates
+        :param ys: 2d array-like, one row with the y values of each candidate
+        :return: numpy array with the relative difference of each candidate (row)
+        """
+        x = np.asarray(x, dtype=np.float64)
+        ys = np.atleast_2d(np.asarray(ys, dtype=np.float64))
+        if ys.shape[1] != x.size:
+            raise ValueError("Each row of ys should have a y value for each x value. "
+                             "x: {x_shape} ys: {ys_shape}".format(x_shape=x.shape, ys_shape=ys.shape))
+        if x.size > 1 and np.any(x[1:] < x[:-1]):
+            order = np.argsort(x, kind='stable')
+            x, ys = x[order], ys[:, order]
+        total_area = self._total_area(x)
+        grid = merge_grids(self.x, x)
+        diff = interp_curve(grid, self.x, self.y) - interp_rows(grid, x, ys)
+        return area_between(grid, diff) / total_area
+
+
+class SlidingWindowCurveDiffCalculator(object):
+    """
+    Keeps the relative difference between two curves which grow over time (e.g. the actual occupancy and the
+    predictions in LearningMode.live) up to date, over a window with a fixed length.
+
+    The area between the curves is stored per interval between two consecutive x values of the curves. Appending a
+    point adds the intervals which both curves now cover and intervals which end up outside of the window are
+    evicted, so each point costs amortized O(1), independent of the length of the window.
+    Intervals are evicted as a whole, once they end before the beginning of the window.
+    """
+
+    def __init__(self, max, window):
+        """
+        :param max: the max to which the relative difference will be compared
+        :param window: the length of the window - timedelta or seconds
+        """
+        self.max = max
+        self.window = window.total_seconds() if hasattr(window, 'total_seconds') else float(window)
+        # per curve: the last point before the covered x-range ends and the points after it
+        self._previous = [None, None]
+        self._pending = [deque(), deque()]
+        # the curves are compared up to this x value
+        self._covered_until = None
+        # (x_from, x_to, area) of each interval within the window
+        self._intervals = deque()
+        self._area = 0.0
+        self._evicted_since_sum = 0
+
+    def add_point_to_curve1(self, point):
+        """
+        :param point: Point/DatePoint, with x bigger than the x of the previously added point of curve1
+        :raises ValueError - if the point is not after the last point of the curve
+        """
+        self._add_point(0, point)
+
+    def add_point_to_curve2(self, point):
+        """
+        See add_point_to_curve1()
+        """
+        self._add_point(1, point)
+
+    @property
+    def area(self):
+        """
+        The area between the curves within the window
+        """
+        return self._area
+
+    @property
+    def duration(self):
+        """
+        The length (in seconds) of the x-range within the window covered by both curves
+        """
+        if not self._intervals:
+            return 0.0
+        return self._intervals[-1][1] - self._intervals[0][0]
+
+    def get_relative_difference(self):
+        """
+        Same as CurveDiffCalculator.get_relative_difference() for the part of the curves within the window
+        :return: the difference expressed in percentage. None if the curves don't overlap yet.
+        """
+        if not self._intervals:
+            return None
+        return self._area / float(self.max * self.duration)
+
+    def _add_point(self, curve_idx, point):
+        pending = self._pending[curve_idx]
+        last = pending[-1] if pending else self._previous[curve_idx]
+        if last is not None and point.x <= last.x:
+            raise ValueError("Points should be added in increasing order of x. "
+                             "Last x: {last} new x: {new}".format(last=last.x, new=point.x))
+        pending.append(point)
+        self._extend_covered_range()
+        self._evict()
+
+    def _extend_covered_range(self):
+        if not (self._pending[0] or self._previous[0]) or not (self._pending[1] or self._previous[1]):
+            return
+        new_covered_until = min(self._last_x(0), self._last_x(1))
+        if self._covered_until is None:
+            start = max(self._first_x(0), self._first_x(1))
+            if new_covered_until <= start:
+                return
+            self._move_to(start)
+        if new_covered_until <= self._covered_until:
+            return
+
+        x_from = self._covered_until
+        diff_from = self._diff_at(x_from)
+        while x_from < new_covered_until:
+            x_to = min(self._pending[0][0].x, self._pending[1][0].x)
+            diff_to = self._diff_at(x_to)
+            area = _area_between_lines(x_to - x_from, diff_from, diff_to)
+            self._intervals.append((x_from, x_to, area))
+            self._area += area
+            self._move_to(x_to)
+            x_from, diff_from = x_to, diff_to
+
+    def _move_to(self, x):
+        """
+        Mark the curves as compared up to :x. Points which are no longer needed to interpolate the curves are dropped.
+        """
+        for curve_idx in (0, 1):
+            pending = self._pending[curve_idx]
+            while pending and pending[0].x <= x:
+                self._previous[curve_idx] = pending.popleft()
+        self._covered_until = x
+
+    def _evict(self):
+        if self._covered_until is None:
+            return
+        window_start = self._covered_until - self.window
+        while self._intervals and self._intervals[0][1] <= window_start:
+            self._area -= self._intervals.popleft()[2]
+            self._evicted_since_sum += 1
+        # re-sum from time to time, so that floating point errors of the subtractions don't accumulate
+        if self._evicted_since_sum > len(self._intervals):
+            self._area = math.fsum(interval[2] for interval in self._intervals)
+            self._evicted_since_sum = 0
+
+    def _diff_at(self, x):
+        return self._y_at(0, x) - self._y_at(1, x)
+
+    def _y_at(self, curve_idx, x):
+        previous = self._previous[curve_idx]
+        pending = self._pending[curve_idx]
+        if previous is None or previous.x == x or not pending:
+            return (previous or pending[0]).y
+        return _y_on_line(previous, pending[0], x)
+
+    def _first_x(self, curve_idx):
+        previous = self._previous[curve_idx]
+        return previous.x if previous is not None else self._pending[curve_idx][0].x
+
+    def _last_x(self, curve_idx):
+        pending = self._pending[curve_idx]
+        return pending[-1].x if pending else self._previous[curve_idx].x
+
+
+def curve_to_points(curve):
+    """
+    The object based calculations work on lists of points.
+    :param curve: a list of points, a Curve or a (x, y) tuple of arrays
+    :return: :curve if it is already a list of points, otherwise a new list of Point objects
+    """
+    if isinstance(curve, Curve) or is_array_curve(curve):
+        x, y = curve_to_arrays(curve)
+        return [Point(x_value, y_value) for x_value, y_value in zip(x.tolist(), y.tolist())]
+    return curve
+
+
+def comparison_duration_in_seconds(curve1, x1, x2):
+    """
+    The length of the x-range over which two curves are compared - the range both of them cover.
+    If curve1 lies within curve2, this is the duration of curve1 (see curve_duration_in_seconds()).
+    :param curve1: the first curve as passed by the user
+    :param x1: the sorted x values of :curve1 (only the first and the last are used)
+    :param x2: the sorted x values of the second curve (only the first and the last are used)
+    :raises ValueError - if the curves don't overlap
+    """
+    start = max(x1[0], x2[0])
+    end = min(x1[-1], x2[-1])
+    if start >= end:
+        raise ValueError("The curves don't overlap. curve1: [{start1}, {end1}] curve2: [{start2}, {end2}]".format(
+            start1=x1[0], end1=x1[-1], start2=x2[0], end2=x2[-1]))
+    if start == x1[0] and end == x1[-1]:
+        return curve_duration_in_seconds(curve1, x1)
+    return float(end - start)
+
+
+def curve_duration_in_seconds(curve, x):
+    """
+    The length of a list of DatePoints is measured with their datetimes
+    (their epoch seconds can differ from the datetimes around DST changes).
+    Other curves are measured with their x values.
+    :param curve: the curve as passed by the user
+    :param x: the sorted x values of :curve
+    """
+    if not isinstance(curve, Curve) and not is_array_curve(curve) and len(curve) and hasattr(curve[0], 'datetime'):
+        datetimes = [p.datetime for p in curve]
+        return (max(datetimes) - min(datetimes)).total_seconds()
+    return float(x[-1] - x[0])
+
+
+def _chunk_of(x, y, start, end):
+    """
+    :return: (x, y) slices of a sorted curve with the points within [start, end] and the closest point on each side
+    """
+    first = max(np.searchsorted(x, start, side='right') - 1, 0)
+    last = np.searchsorted(x, end, side='left') + 1
+    return x[first:last], y[first:last]
+
+
+def _area_between_lines(width, diff_from, diff_to):
+    """
+    The area between two lines over an interval, given the difference between them at the ends of the interval.
+    Scalar version of curve_arrays.area_between()
+    """
+    if diff_from * diff_to >= 0:
+        return (abs(diff_from) + abs(diff_to)) * 0.5 * width
+    return (diff_from * diff_from + diff_to * diff_to) / (2.0 * (abs(diff_from) + abs(diff_to))) * width
+
+
+def _ys_on_line(p1, p2, x_from, x_to):
+    """
+    :return: (y at :x_from, y at :x_to) of the line from :p1 to :p2. For a vertical line (:p1 and :p2 have the same x)
+    these are the y values of :p1 and :p2
+    """
+    if p2.x == p1.x:
+        return p1.y, p2.y
+    return _y_on_line(p1, p2, x_from), _y_on_line(p1, p2, x_to)
+
+
+def _y_on_line(p1, p2, x):
+    """
+    :return: the y value at :x of the line through :p1 and :p2
+    """
+    if p2.x == p1.x:
+        return p1.y
+    return p1.y + (p2.y - p1.y) * (x - p1.x) / float(p2.x - p1.x)
+
+
 class Point(object):
+    __slots__ = ('x', 'y')
+
     def __init__(self, x, y):
         self.x = x
         self.y = y
@@ -157,12 +695,16 @@ class Point(object):
 
 
 class DatePoint(Point):
+    __slots__ = ('datetime',)
+
     def __init__(self, datetime_object, y):
         super(DatePoint, self).__init__(time.mktime(datetime_object.timetuple()), y)
         self.datetime = datetime_object
 
 
 class Line(object):
+    __slots__ = ('p1', 'p2', 'equation')
+
     def __init__(self, p1, p2):
         self.p1 = p1
         self.p2 = p2
@@ -198,6 +740,8 @@ class Line(object):
 
 
 class LineEquation(object):
+    __slots__ = ('slope', 'b')
+
     def __init__(self, p1, p2):
         if p2.x - p1.x != 0:
             self.slope = (p2.y - p1.y) / float(p2.x - p1.x)
@@ -230,24 +774,31 @@ class Polygon(object):
     Area calculation adapted from here:
     http://code.activestate.com/recipes/578047-area-of-polygon-using-shoelace-formula/
     """
+    __slots__ = ('corners', 'area')
 
-    def __init__(self, corner_points):
+    def __init__(self, corner_points, ordered=False):
         """
-        The corners are first sorted
+        The corners are first sorted, unless :ordered
         :param corner_points: the corners of the polygon, they might be unsorted
+        :param ordered: True if :corner_points are already in the order of the boundary of the polygon (clockwise or
+        counter-clockwise). Then they are not sorted by angle, which is faster and also correct for non-convex
+        polygons.
         """
-        # First sort
-        self.corners = self.sort_polygon([(p.x, p.y) for p in corner_points])
+        corners = [(p.x, p.y) for p in corner_points]
+        if not ordered:
+            corners = self.sort_polygon(corners)
+        self.corners = corners
         self.area = self.calculate_area(self.corners)
 
     @staticmethod
     def calculate_area(corners):
-        n = len(corners)  # of corners
+        if not corners:
+            return 0.0
         area = 0.0
-        for i in range(n):
-            j = (i + 1) % n
-            area += corners[i][0] * corners[j][1]
-            area -= corners[j][0] * corners[i][1]
+        previous_x, previous_y = corners[-1]
+        for x, y in corners:
+            area += previous_x * y - x * previous_y
+            previous_x, previous_y = x, y
         area = abs(area) / 2.0
         return area
 
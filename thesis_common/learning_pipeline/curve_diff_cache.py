@@ -0,0 +1,118 @@
+"""
+Memoization of relative differences between curves, for experiments which score the same
+(ground truth, prediction) pairs many times.
+"""
+import hashlib
+import os
+from collections import OrderedDict
+from .curve_arrays import curve_to_arrays
+from .curve_calculations import CurveDiffCalculator, comparison_duration_in_seconds
+from .enums import CurveDiffEngine
+
+
+class CurveDiffCache(object):
+    """
+    Opt-in cache of CurveDiffCalculator.get_relative_difference() results.
+    The key is a hash of the contents of both curves, the max and the engine, so equal curves hit the cache even if
+    they are different objects. The most recently used :max_size results are kept in memory. If :directory is set,
+    every result is also written there (one small file per key) and read back on a miss in memory, so the cache
+    survives restarts and can be shared between processes.
+    """
+
+    def __init__(self, max_size=1024, directory=None, engine=CurveDiffEngine.numpy):
+        """
+        :param max_size: max number of results kept in memory
+        :param directory: path of a directory for the on-disk tier. None to keep the results only in memory.
+        :param engine: CurveDiffEngine used on a miss
+        """
+        self.max_size = max_size
+        self.directory = directory
+        self.engine = engine
+        self._results = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def get_relative_difference(self, curve1, curve2, max):
+        """
+        Same as CurveDiffCalculator(curve1, curve2, max, engine=self.engine).get_relative_difference()
+        :param curve1: a list of points, a Curve or a (x, y) tuple of arrays
+        :param curve2: a list of points, a Curve or a (x, y) tuple of arrays
+        """
+        cache_key = self.key(curve1, curve2, max)
+        if cache_key in self._results:
+            self._results.move_to_end(cache_key)
+            self.hits += 1
+            return self._results[cache_key]
+
+        result = self._read_from_disk(cache_key)
+        if result is not None:
+            self.disk_hits += 1
+        else:
+            self.misses += 1
+            result = CurveDiffCalculator(curve1, curve2, max, engine=self.engine).get_relative_difference()
+            self._write_to_disk(cache_key, result)
+        self._results[cache_key] = result
+        if len(self._results) > self.max_size:
+            self._results.popitem(last=False)
+        return result
+
+    def key(self, curve1, curve2, max):
+        """
+        :return: hex digest of the x and y values of both curves, the length of the compared range, :max and the engine
+        """
+        x1, y1 = curve_to_arrays(curve1)
+        x2, y2 = curve_to_arrays(curve2)
+        digest = hashlib.blake2b(digest_size=20)
+        for array in (x1, y1, x2, y2):
+            digest.update(array.tobytes())
+            # separate the arrays, so that moving a value from one array to the next changes the key
+            digest.update(b'|')
+        # for DatePoint lists the duration comes from the datetimes, which the arrays don't have
+        duration = comparison_duration_in_seconds(curve1, x1, x2)
+        digest.update(repr((duration, max, self.engine.name)).encode('utf-8'))
+        return digest.hexdigest()
+
+    @property
+    def stats(self):
+        """
+        :return: dict with the number of memory hits, disk hits and misses, and the ratio of lookups which were hits
+        """
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'size': len(self._results),
+            'hit_rate': (self.hits + self.disk_hits) / float(lookups) if lookups else 0.0,
+        }
+
+    def clear(self):
+        """
+        Empty the memory tier and reset the statistics. The on-disk tier is kept.
+        """
+        self._results.clear()
+        self.hits = self.disk_hits = self.misses = 0
+
+    def _path(self, cache_key):
+        return os.path.join(self.directory, cache_key)
+
+    def _read_from_disk(self, cache_key):
+        if not self.directory:
+            return None
+        try:
+            with open(self._path(cache_key), 'r') as f:
+                return float(f.read())
+        except (IOError, OSError, ValueError):
+            return None
+
+    def _write_to_disk(self, cache_key, result):
+        if not self.directory:
+            return
+        # write to a temporary file first, so other processes never read a half written result
+        tmp_path = "%s.%i.tmp" % (self._path(cache_key), os.getpid())
+        with open(tmp_path, 'w') as f:
+            f.write(repr(result))
+        os.replace(tmp_path, self._path(cache_key))
@@ -0,0 +1,89 @@
+"""
+Calculate the relative differences of many pairs of curves (e.g. every venue x day x Label) on a pool of processes.
+"""
+from collections import deque
+from multiprocessing import cpu_count
+from concurrent.futures import ProcessPoolExecutor
+from .curve_arrays import Curve, curve_to_arrays, area_between_curves, is_array_curve
+from .curve_calculations import comparison_duration_in_seconds
+
+
+class CurveDiffRunner(object):
+    """
+    Distributes (reference, candidate, max) jobs across a concurrent.futures process pool.
+    The curves of the jobs must be Curves or (x, y) tuples of arrays - they are pickled as a few compact buffers, and
+    the calling process only groups the jobs in chunks, while all calculations run in the workers.
+    Lists of DatePoint objects are not accepted: converting them, or even just pickling them, costs more than
+    the calculation itself, so that work would be done serially by the calling process whatever the number of
+    workers. Convert them once with Curve.from_points() (or create the curves with Curve.from_venue_measurements()).
+    Jobs are sent in chunks, to keep the overhead per job low,
+    and at most :max_pending_chunks chunks are in flight, so :jobs can be a (long) generator.
+    """
+
+    def __init__(self, max_workers=None, chunk_size=64, max_pending_chunks=None):
+        """
+        :param max_workers: number of processes. None means the number of CPUs.
+        :param chunk_size: number of jobs sent to a worker at once
+        :param max_pending_chunks: how many chunks can be submitted, but not yet yielded. Default is 4 per worker.
+        """
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self.max_pending_chunks = max_pending_chunks
+
+    def run(self, jobs):
+        """
+        :param jobs: iterable of (reference_curve, candidate_curve, max) tuples. The curves are Curves or
+        (x, y) tuples of arrays.
+        :return: generator with the relative difference of each job, in the order of :jobs
+        :raises TypeError - if a curve is a list of points
+        """
+        max_workers = self.max_workers or cpu_count()
+        max_pending = self.max_pending_chunks or 4 * max_workers
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            pending = deque()
+            for chunk in self._chunks(jobs):
+                pending.append(executor.submit(_relative_differences_of_chunk, chunk))
+                if len(pending) >= max_pending:
+                    for result in pending.popleft().result():
+                        yield result
+            while pending:
+                for result in pending.popleft().result():
+                    yield result
+
+    def _chunks(self, jobs):
+        chunk = []
+        for job in jobs:
+            reference_curve, candidate_curve, _ = job
+            for curve in (reference_curve, candidate_curve):
+                if not (isinstance(curve, Curve) or is_array_curve(curve)):
+                    raise TypeError("The curves of a CurveDiffRunner job should be Curves or (x, y) tuples of arrays. "
+                                    "Convert lists of points with Curve.from_points()")
+            chunk.append(job)
+            if len(chunk) == self.chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+def to_array_job(reference_curve, candidate_curve, max):
+    """
+    :return: (x1, y1, x2, y2, total_area) - what a worker needs to calculate the relative difference of the job
+    """
+    x1, y1 = curve_to_arrays(reference_curve)
+    x2, y2 = curve_to_arrays(candidate_curve)
+    total_area = float(max * comparison_duration_in_seconds(reference_curve, x1, x2))
+    return x1, y1, x2, y2, total_area
+
+
+def _relative_differences_of_chunk(chunk):
+    """
+    Runs in the worker processes.
+    :param chunk: list of (reference_curve, candidate_curve, max) jobs
+    :return: list of relative differences
+    """
+    result = []
+    for job in chunk:
+        x1, y1, x2, y2, total_area = to_array_job(*job)
+        result.append(area_between_curves(x1, y1, x2, y2) / total_area)
+    return result
@@ -23,4 +23,36 @@ class LearningMode(SerializableEnum):
     simulation = 'simulaiton_learning_mode'
 
 
+class CurveDiffEngine(SerializableEnum):
+    """
+    The implementation CurveDiffCalculator uses to calculate the relative difference between two curves.
+    polygon - builds Point/Line/Polygon objects for the regions between the curves
+    numpy - integrates |curve1 - curve2| over the merged x-grid of the two curves with numpy arrays
+    """
+    polygon = 'polygon_curve_diff_engine'
+    numpy = 'numpy_curve_diff_engine'
+
+
+class CurveMetric(SerializableEnum):
+    """
+    Error metrics of a curve (e.g. predictions) against another one (e.g. the ground truth), see CurveEvaluator.
+    Apart from relative_difference, the metrics are averages over time (integrals over the x-range both curves cover,
+    divided by its length) of the difference between the curves.
+    """
+    relative_difference = 'relative_difference_curve_metric'
+    mae = 'mean_absolute_error_curve_metric'
+    rmse = 'root_mean_square_error_curve_metric'
+    max_error = 'max_error_curve_metric'
+    bias = 'bias_curve_metric'
+
+
+class CompressionAlgorithm(SerializableEnum):
+    """
+    How the redis adapters compress the values they store, see PayloadCodec.
+    lzma compresses better, zlib is (a lot) faster.
+    """
+    zlib = 'zlib_compression_algorithm'
+    lzma = 'lzma_compression_algorithm'
+
+
 make_enum_serialazable(__name__)
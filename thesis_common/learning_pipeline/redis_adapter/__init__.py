@@ -1,4 +1,5 @@
 from .training_data_adapter import TrainingDataRedisAdapter
 from .stored_predictions_adopter import StoredPredictionsAdapter
+from .codec import PayloadCodec
 
 from .utils import *
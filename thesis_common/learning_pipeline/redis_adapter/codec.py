@@ -0,0 +1,97 @@
+import lzma
+import zlib
+from thesis_common.learning_pipeline.enums import CompressionAlgorithm
+
+# a compressed value starts with a zero byte, which a json (or any other text) value never starts with,
+# followed by one byte for the algorithm. Values without the header are stored as they are.
+_headers = {
+    CompressionAlgorithm.zlib: b'\x00z',
+    CompressionAlgorithm.lzma: b'\x00x',
+}
+_algorithms_by_header = dict((header, algorithm) for algorithm, header in _headers.items())
+_header_length = 2
+
+
+def _compress(algorithm, data, level):
+    if algorithm is CompressionAlgorithm.zlib:
+        return zlib.compress(data, 6 if level is None else level)
+    return lzma.compress(data, preset=6 if level is None else level)
+
+
+def _decompress(algorithm, data):
+    if algorithm is CompressionAlgorithm.zlib:
+        return zlib.decompress(data)
+    return lzma.decompress(data)
+
+
+class PayloadCodec(object):
+    """
+    Compresses the values the redis adapters store and decompresses the values they read.
+    Only values of at least :threshold bytes are compressed - for shorter ones the header and the compression
+    cost more than they save. A compressed value is the header (see _headers) followed by the compressed data,
+    so values stored before the compression was introduced, or stored uncompressed, are still read correctly.
+    The codec keeps statistics of the values it encoded, see stats.
+    """
+
+    def __init__(self, algorithm=CompressionAlgorithm.zlib, threshold=1024, level=None):
+        """
+        :param algorithm: CompressionAlgorithm used for new values. Values compressed with any algorithm are read.
+        :param threshold: min size in bytes of the values which are compressed. None to never compress
+        :param level: compression level (zlib) or preset (lzma). None for the default of the algorithm
+        """
+        self.algorithm = algorithm
+        self.threshold = threshold
+        self.level = level
+        self.encoded_values = 0
+        self.compressed_values = 0
+        self.bytes_before = 0
+        self.bytes_after = 0
+
+    def encode(self, value):
+        """
+        :param value: str or bytes
+        :return: :value as it is, if it's below the threshold or doesn't get smaller, else the compressed bytes
+        """
+        data = value.encode('utf-8') if not isinstance(value, bytes) else value
+        self.encoded_values += 1
+        self.bytes_before += len(data)
+        if self.threshold is not None and len(data) >= self.threshold:
+            compressed = _headers[self.algorithm] + _compress(self.algorithm, data, self.level)
+            if len(compressed) < len(data):
+                self.compressed_values += 1
+                self.bytes_after += len(compressed)
+                return compressed
+        self.bytes_after += len(data)
+        return value
+
+    def decode(self, value, decode_responses=True):
+        """
+        :param value: bytes as read from redis, or None
+        :param decode_responses: if True, return str, else bytes
+        :return: the original value, None if :value is None
+        :raises ValueError - if :value has the header of an unknown algorithm
+        """
+        if value is None:
+            return None
+        if isinstance(value, bytes) and value[:1] == b'\x00':
+            algorithm = _algorithms_by_header.get(value[:_header_length])
+            if algorithm is None:
+                raise ValueError("Unknown compression header %r" % value[:_header_length])
+            value = _decompress(algorithm, value[_header_length:])
+        if decode_responses and isinstance(value, bytes):
+            return value.decode('utf-8')
+        return value
+
+    @property
+    def stats(self):
+        """
+        :return: dict with the number of encoded and compressed values, their size in bytes before and after
+        encoding, and the compression ratio (size before / size after)
+        """
+        return {
+            'encoded_values': self.encoded_values,
+            'compressed_values': self.compressed_values,
+            'bytes_before': self.bytes_before,
+            'bytes_after': self.bytes_after,
+            'ratio': self.bytes_before / float(self.bytes_after) if self.bytes_after else 1.0,
+        }
@@ -2,7 +2,9 @@
 # i've misspelled enqueue probably million times in this file.
 from redis import StrictRedis as RedisConnection
 from os import getenv
-from .utils import get_non_venue_part_of_key, key, venue_wildcard_key
+from .utils import get_non_venue_part_of_key, key, venues_key, venue_registry_key, registry_migrated_key, \
+    is_registry_key, get_venue_from_key
+from .codec import PayloadCodec
 from thesis_common.common import thesis_logger
 
 
@@ -18,7 +20,13 @@ class RedisAdapter(object):
                  host=None,
                  db=None,
                  port=None,
-                 decode_responses=True):
+                 decode_responses=True,
+                 codec=None):
+        """
+        :param codec: PayloadCodec, which compresses the stored values. By default values are stored uncompressed,
+        because readers on 0.2.1 can't read compressed values. Every later reader can, so once all of them are
+        upgraded, pass PayloadCodec() to compress values of 1KB or more with zlib.
+        """
         host = host or getenv("REDIS_HOST")
         db = stringify_int(db) or int(getenv("REDIS_DB"))  # "0" is a truthy value
         port = stringify_int(port) or int(getenv("REDIS_PORT", 6379))
@@ -27,7 +35,16 @@ class RedisAdapter(object):
                                  db=db,
                                  port=port,
                                  decode_responses=decode_responses)
-        
+        # compressed values are binary, so the values are read with a connection which doesn't decode the responses.
+        # PayloadCodec.decode() decodes them after decompressing.
+        self.raw = self.r
+        if decode_responses:
+            self.raw = RedisConnection(host=host, db=db, port=port, decode_responses=False)
+        self.decode_responses = decode_responses
+        self.codec = codec or PayloadCodec(threshold=None)
+        # see migrate_key_registry()
+        self._key_registry_migrated = False
+
         # fail fast if we can't connect
         self.r.ping()
 
@@ -41,6 +58,22 @@ class RedisAdapter(object):
             port=port,
         ))
 
+    def encode_value(self, value):
+        return self.codec.encode(value)
+
+    def decode_value(self, value):
+        """
+        :param value: a value read with self.raw
+        """
+        return self.codec.decode(value, decode_responses=self.decode_responses)
+
+    @property
+    def compression_stats(self):
+        """
+        :return: statistics of the values stored by this adapter, see PayloadCodec.stats
+        """
+        return self.codec.stats
+
     def redis_is_up(self, ):
         try:
             return self.r.ping()
@@ -52,6 +85,76 @@ class RedisAdapter(object):
         Deletes ALL keys of the current database
         :return:
         """
-        keys = self.r.keys("*")
-        if keys:
-            self.r.delete(*keys)
+        batch = []
+        for k in self.scan_keys():
+            batch.append(k)
+            if len(batch) == 1000:
+                self.r.delete(*batch)
+                batch = []
+        if batch:
+            self.r.delete(*batch)
+        self._key_registry_migrated = False
+
+    def scan_keys(self, pattern="*", count=1000):
+        """
+        Iterate over the keys matching :pattern with SCAN, which (unlike KEYS) doesn't block the redis server
+        until all keys are checked. A key can be returned more than once.
+        :param count: how many keys redis checks per SCAN call
+        :return: generator of keys
+        """
+        return self.r.scan_iter(match=pattern, count=count)
+
+    def register_keys(self, pipe, venue, *keys):
+        """
+        Add :keys to the set with the keys of :venue, and :venue to the set of venues.
+        Call it with the pipeline (transaction) which creates the keys, so that a key is never without a registry
+        entry. With the registry the keys of a venue are found without going through the keys of all venues.
+        :param pipe: pipeline of self.r or self.raw
+        """
+        pipe.sadd(venue_registry_key(venue), *keys)
+        pipe.sadd(venues_key, venue)
+
+    def get_keys_of_venue(self, venue):
+        """
+        :return: list of the existing keys of :venue, as registered with register_keys()
+        """
+        self.migrate_key_registry()
+        keys = sorted(self.r.smembers(venue_registry_key(venue)))
+        # a queue is deleted by redis when its last element is dequeued, while its key stays in the registry
+        pipe = self.r.pipeline(transaction=False)
+        for k in keys:
+            pipe.exists(k)
+        return [k for k, exists in zip(keys, pipe.execute()) if exists]
+
+    def get_venues(self):
+        """
+        :return: set with the names of all venues, which have (or had) keys.
+        """
+        self.migrate_key_registry()
+        return self.r.smembers(venues_key)
+
+    def migrate_key_registry(self):
+        """
+        Called before the keys or the venues are looked up in the registry. Keys created by 0.2.1 (before the
+        registry existed) aren't registered, so the first lookup in a database registers all of them with
+        rebuild_key_registry(), which marks the database as migrated. In a migrated database this is one EXISTS,
+        and only for the first lookup of this adapter.
+        """
+        if self._key_registry_migrated:
+            return
+        if not self.r.exists(registry_migrated_key):
+            self.rebuild_key_registry()
+        self._key_registry_migrated = True
+
+    def rebuild_key_registry(self):
+        """
+        Register all keys which aren't registered - e.g. the keys created by 0.2.1, before the registry existed -
+        and mark the database as migrated (see migrate_key_registry()). Goes over all keys with SCAN.
+        Keys which a writer on 0.2.1 creates after the migration are found only after this is run again.
+        """
+        pipe = self.r.pipeline(transaction=False)
+        for k in self.scan_keys():
+            if not is_registry_key(k):
+                self.register_keys(pipe, get_venue_from_key(k), k)
+        pipe.set(registry_migrated_key, 1)
+        pipe.execute()
@@ -0,0 +1,97 @@
+"""
+Delta encoding of the snapshots in a cylinder queue.
+A snapshot is a json list - the contents of a cylinder at a flush of the Memory Engine. Consecutive snapshots of a
+cylinder mostly overlap: the next one is the previous one without its first (oldest) entries and with a few new
+entries at the end. Such a snapshot is stored as a delta entry - the number of evicted entries and the appended
+entries - instead of in full.
+"""
+import json
+
+# a delta entry is this prefix followed by the json of [number of evicted entries, [appended entries]].
+# a json value never starts with it.
+delta_prefix = u"\x01"
+
+
+def is_delta(entry):
+    """
+    :param entry: str, as stored in a cylinder queue
+    """
+    return entry.startswith(delta_prefix)
+
+
+def make_delta_entry(previous, snapshot):
+    """
+    :param previous: list, the decoded previous snapshot
+    :param snapshot: str, the json of the new snapshot
+    :return: the delta entry which turns :previous into :snapshot.
+    None if :snapshot isn't a json list, or the delta wouldn't be shorter than :snapshot
+    """
+    try:
+        current = json.loads(snapshot)
+    except ValueError:
+        return None
+    if not isinstance(current, list) or not current:
+        return None
+    # the fewest entries of :previous to evict, so that the rest of it is the beginning of :current
+    for evicted in range(len(previous) + 1):
+        kept = len(previous) - evicted
+        if kept == 0 or (previous[evicted] == current[0] and previous[evicted:] == current[:kept]):
+            break
+    if kept == 0:
+        return None
+    entry = delta_prefix + json.dumps([evicted, current[kept:]])
+    return entry if len(entry) < len(snapshot) else None
+
+
+def apply_delta_entry(previous, entry):
+    """
+    :param previous: list, the decoded previous snapshot
+    :param entry: a delta entry, see make_delta_entry()
+    :return: list, the decoded snapshot
+    """
+    evicted, appended = json.loads(entry[len(delta_prefix):])
+    return previous[evicted:] + appended
+
+
+def reconstruct_snapshots(entries):
+    """
+    :param entries: list of the entries of a queue, in the order of redis.lrange() - the newest first. The last
+    (oldest) entry should be a full snapshot.
+    :return: list with the full snapshot for each entry. The snapshots of delta entries are json.dumps()-ed again,
+    so they can be formatted differently than the original json (but decode to the same value).
+    :raises ValueError - if the oldest entry is a delta entry
+    """
+    if entries and is_delta(entries[-1]):
+        raise ValueError("The oldest entry of a queue should be a full snapshot")
+    snapshots = [None] * len(entries)
+    current = None
+    for i in range(len(entries) - 1, -1, -1):
+        entry = entries[i]
+        if is_delta(entry):
+            current = apply_delta_entry(current, entry)
+            snapshots[i] = json.dumps(current)
+        else:
+            snapshots[i] = entry
+            # decode a full snapshot only if the next one is a delta of it
+            current = json.loads(entry) if i > 0 and is_delta(entries[i - 1]) else None
+    return snapshots
+
+
+def newest_snapshot(entries, keyframe_interval):
+    """
+    :param entries: the newest entries of a queue, as returned by redis.lrange(key, 0, keyframe_interval - 1)
+    :param keyframe_interval: a full snapshot is stored at least every :keyframe_interval entries
+    :return: the decoded newest snapshot, if the next entry can be a delta of it, else None
+    """
+    for i, entry in enumerate(entries[:keyframe_interval - 1]):
+        if not is_delta(entry):
+            try:
+                current = json.loads(entry)
+            except ValueError:
+                return None
+            if not isinstance(current, list):
+                return None
+            for delta in reversed(entries[:i]):
+                current = apply_delta_entry(current, delta)
+            return current
+    return None
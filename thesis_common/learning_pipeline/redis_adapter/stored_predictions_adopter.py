@@ -20,7 +20,7 @@ class StoredPredictionsAdapter(RedisAdapter):
         :param datetime_newest_training: datetime object, with which we label the set of predictions. It is the
         datetime of the newest entry used to train the model(s) used when making the prediction.
         :param predictions: json string. the json is a map between a datetime and a number
-        (the number is the prediction for this datetime)
+        (the number is the prediction for this datetime). Compressed with self.codec if long enough.
         :return: None
         :raises ValueError - if the underlying redis db already has predictions for this venue and :datetime_newest_training
         """
@@ -28,14 +28,17 @@ class StoredPredictionsAdapter(RedisAdapter):
         # we will store the predictions under this key
         composite_key = key(venue, dt_str)
 
-        # set will be successful only if the key doesn't exist, because of nx=True flag
-        set_is_successfull = self.r.set(composite_key, predictions, nx=True)
-        if set_is_successfull:
-            self._add_avaialable_predictions(venue=venue, prediction_key=composite_key)
-        else:
-            raise ValueError("Key {key} is already present in the redis db.".format(key=composite_key))
+        def store(pipe):
+            # the key is watched, so the transaction fails (and is retried) if the key is created after this check
+            if pipe.exists(composite_key):
+                raise ValueError("Key {key} is already present in the redis db.".format(key=composite_key))
+            pipe.multi()
+            pipe.set(composite_key, self.encode_value(predictions))
+            self._add_avaialable_predictions(venue=venue, prediction_key=composite_key, pipe=pipe)
 
-    def _add_avaialable_predictions(self, venue, prediction_key):
+        self.r.transaction(store, composite_key)
+
+    def _add_avaialable_predictions(self, venue, prediction_key, pipe=None):
         """
         store_predictions() uses redis SET function. set() doesn't have any ordering guarantees, so it will be
         expensive to know which was the last collection of predictions stored by store_predictions().
@@ -44,9 +47,12 @@ class StoredPredictionsAdapter(RedisAdapter):
         of the newest set of predictions for a venue.
 
         :param prediction_key: the key used to store the prediction.
+        :param pipe: the transaction which stores the prediction. If None, the key is added right away.
         :return: None
         """
-        self.enqueue(self.r)(key(venue, self._predictions_stack_tag), prediction_key)
+        stack_key = key(venue, self._predictions_stack_tag)
+        self.enqueue(pipe or self.r)(stack_key, prediction_key)
+        self.register_keys(pipe or self.r, venue, prediction_key, stack_key)
 
     def get_keys_of_available_predictions_for_venue(self, venue):
         """
@@ -55,9 +61,8 @@ class StoredPredictionsAdapter(RedisAdapter):
         See _add_avaialable_predictions().
         :return: list of keys. Agains each of these keys there's a set of predictions. The first element is the newest key
         """
-        k = key(venue, self._predictions_stack_tag)
         # return all elements of the list (range over the whole list)
-        return self.r.lrange(k, 0, self.r.llen(k))
+        return self.r.lrange(key(venue, self._predictions_stack_tag), 0, -1)
 
     def get_key_of_newest_predictions(self, venue):
         """
@@ -85,7 +90,7 @@ class StoredPredictionsAdapter(RedisAdapter):
         :returns The funciton returns a tuple, where the first element is the timestamp of the newest training entry, and the second is a json encoded string.
         """
 
-        predictions = self.r.get(predictions_key)
+        predictions = self.decode_value(self.raw.get(predictions_key))
         # we have the JSON with timestamp-prediction pairs.
         # Let's also return the datetime, which is encoded within the key
         dt_obj = self.get_datetime_part_of_key(predictions_key)
@@ -1,6 +1,31 @@
+from redis.exceptions import ResponseError
 from .redis_adaptor import RedisAdapter
-from .utils import key, get_non_venue_part_of_key
+from .utils import key, get_non_venue_part_of_key, venue_registry_key, venues_key
+from .snapshot_deltas import is_delta, make_delta_entry, newest_snapshot, reconstruct_snapshots
 
+# KEYS: the queues of the cylinders, the key registry of the venue, the set of venues
+# ARGV: the venue, the snapshot for each queue
+# Enqueues the snapshots only if all queues have the same length, and registers the keys.
+# Returns the new lengths of the queues.
+_enqueue_snapshots_script = """
+local queues = #KEYS - 2
+for i = 2, queues do
+    if redis.call('LLEN', KEYS[i]) ~= redis.call('LLEN', KEYS[1]) then
+        local lengths = {}
+        for j = 1, queues do
+            lengths[j] = redis.call('LLEN', KEYS[j])
+        end
+        return redis.error_reply('queue lengths differ: ' .. table.concat(lengths, ', '))
+    end
+end
+local new_lengths = {}
+for i = 1, queues do
+    new_lengths[i] = redis.call('LPUSH', KEYS[i], ARGV[i + 1])
+    redis.call('SADD', KEYS[queues + 1], KEYS[i])
+end
+redis.call('SADD', KEYS[queues + 2], ARGV[1])
+return new_lengths
+"""
 
 class TrainingDataRedisAdapter(RedisAdapter):
     """
@@ -11,41 +36,51 @@ class TrainingDataRedisAdapter(RedisAdapter):
     """
 
     def __init__(self, *args, **kwargs):
+        """
+        :param delta_snapshots: (keyword) if True, a snapshot which overlaps the newest snapshot in its queue is
+        stored as a delta of it (the evicted and the appended entries, see snapshot_deltas.py). Only every
+        :keyframe_interval-th snapshot, and the two oldest snapshots of each queue, are stored in full.
+        The dequeue and get methods return full snapshots, but all adapters which enqueue to or dequeue from
+        the same queues should use the same mode. Only one client at a time should do a blocking dequeue of a queue.
+        :param keyframe_interval: (keyword) max number of entries from one full snapshot to the next
+        """
+        self.delta_snapshots = kwargs.pop('delta_snapshots', False)
+        self.keyframe_interval = kwargs.pop('keyframe_interval', 10)
         super(TrainingDataRedisAdapter, self).__init__(*args, **kwargs)
+        # runs with EVALSHA. the script is loaded to the server on the first call
+        self._enqueue_snapshots = self.raw.register_script(_enqueue_snapshots_script)
 
     def atomic_cylinders_enqueue(self, venue, cylinders_dikt):
         """
         For the venue, atomically enqueue to the queues of all cylinders.
 
-        We go the extra mile with the pipeline, because we want to ensure that
-        when we enqueue data for a venue, the queues have the same len before and after the transaction.
-        Transaction ensures that if we enqueue on 4 queues, and we are halfway-through,
-        if another client tries to dequeue/check the len of a queue, he will first have to wait for the transaction
-        to finish.
-
-        There's NO rollback supported, BUT the pipeline is executed as one
-        command (thus no other clients can enqueue/dequeue at the same time)
+        We go the extra mile, because we want to ensure that
+        when we enqueue data for a venue, the queues have the same len before and after the enqueuing.
+        The length check and the enqueuing are done by one lua script (or, with delta_snapshots, one transaction),
+        which redis runs as one command - no other clients can enqueue/dequeue at the same time, and it takes
+        a single round trip.
+        If the lengths differ, nothing is enqueued.
         :param venue:
-        :param cylinders_dikt: keys: cylinder label, values: cylinder data
-        :return: none
-        :raises RuntimeError, if the length of the queues is different after the atomic enqueuing operation
+        :param cylinders_dikt: keys: cylinder label, values: cylinder data. Compressed with self.codec if long enough.
+        :return: dikt with keys the cylinder labels and values the new length of their queues
+        :raises RuntimeError, if the queues of the cylinders have different lengths
+        :raises ValueError, if :cylinders_dikt is empty
         """
-        pipe = self.r.pipeline(transaction=True)
-        for cyl_label, cyl_data in cylinders_dikt.items():
-            self.enqueue(pipe)(key(venue, cyl_label), cyl_data)
-
-        # commit the pipeline
-        pipe.execute()
-        cyl_labels = cylinders_dikt.keys()
-        cylinder_lengths = [self.get_size_of_cylinder_queue(venue=venue, cylinder=cyl_label) for cyl_label in
-                            cyl_labels]
-        if len(set(cylinder_lengths)) != 1:
-            raise RuntimeError(
-                "The length of the queues for [{venue}] differ. queue lenghts:[{lenghts}]. keys:[{keys}]".format(
-                    lenghts=cylinder_lengths,
-                    venue=venue,
-                    keys=cyl_labels
-                ))
+        if not cylinders_dikt:
+            raise ValueError("Nothing to enqueue for [{venue}] - cylinders_dikt is empty".format(venue=venue))
+        cyl_labels = list(cylinders_dikt.keys())
+        queue_names = [key(venue, cyl_label) for cyl_label in cyl_labels]
+        if self.delta_snapshots:
+            lengths = self.raw.transaction(lambda pipe: self._enqueue_snapshot_deltas(pipe, venue, cylinders_dikt),
+                                           *queue_names, value_from_callable=True)
+        else:
+            try:
+                lengths = self._enqueue_snapshots(
+                    keys=queue_names + [venue_registry_key(venue), venues_key],
+                    args=[venue] + [self.encode_value(cylinders_dikt[cyl_label]) for cyl_label in cyl_labels])
+            except ResponseError as ex:
+                raise _lengths_differ_error(venue, cyl_labels, ex)
+        return dict(zip(cyl_labels, lengths))
 
     def multiple_cylinders_dequeue(self, venue, cylinder_labels):
         """
@@ -62,15 +97,19 @@ class TrainingDataRedisAdapter(RedisAdapter):
         :raises RuntimeError - if some queues returned a result and some didn't.
         """
 
-        pipe = self.r.pipeline(transaction=True)
-        dequeue = self.non_blocking_dequeue(pipe)
-
         result = {}
-        for cyl_label in cylinder_labels:
-            dequeue(key(venue, cyl_label))
+        if self.delta_snapshots:
+            queue_names = [key(venue, cyl_label) for cyl_label in cylinder_labels]
+            response = self.raw.transaction(lambda pipe: self._dequeue_snapshots(pipe, queue_names), *queue_names,
+                                            value_from_callable=True)
+        else:
+            pipe = self.raw.pipeline(transaction=True)
+            dequeue = self.non_blocking_dequeue(pipe)
+            for cyl_label in cylinder_labels:
+                dequeue(key(venue, cyl_label))
+            response = [self.decode_value(cyl_data) for cyl_data in pipe.execute()]
 
         # ensure that either **all** queues returned an element OR **all** queues returned None
-        response = pipe.execute()
         if len(response) is not len(cylinder_labels):
             raise RuntimeError(
                 "The response should return some data (possibly None) for all queues")
@@ -90,11 +129,17 @@ class TrainingDataRedisAdapter(RedisAdapter):
         cyl_key = key(venue, cylinder_label)
         if blocking:
             # brpop returns a  (key, data) tuple. We are interested only in the data
-            response = self.blocking_dequeue(self.r)(cyl_key)
+            response = self.blocking_dequeue(self.raw)(cyl_key)
             assert response, "Response from **blocking** dequeue None"
-            response = response[1]
+            response = self.decode_value(response[1])
+            if self.delta_snapshots:
+                # the popped snapshot was full, and so is the next one. but the one after it can be a delta
+                self.raw.transaction(lambda pipe: self._restore_full_snapshots(pipe, cyl_key), cyl_key)
+        elif self.delta_snapshots:
+            response = self.raw.transaction(lambda pipe: self._dequeue_snapshots(pipe, [cyl_key]), cyl_key,
+                                            value_from_callable=True)[0]
         else:
-            response = self.non_blocking_dequeue(self.r)(cyl_key)
+            response = self.decode_value(self.non_blocking_dequeue(self.raw)(cyl_key))
         return response
 
     def get_queues_for_venue(self, venue):
@@ -105,13 +150,40 @@ class TrainingDataRedisAdapter(RedisAdapter):
         :param venue:
         :return:  dikt with keys the internal name of a cylinder queue and value the queue of this cylinder
         """
-        keys = self.r.keys("%s*" % key(venue, ''))
-        result = {}
-        for k in keys:
-            queue_len = self.r.llen(k)
-            queue = self.r.lrange(k, 0, queue_len)
-            result[k] = queue
+        return self.get_queues_for_venues([venue])[venue]
 
+    def get_queues_for_venues(self, venues, cylinder_labels=None):
+        """
+        Bulk version of get_queues_for_venue(). All queues are read with one pipeline of LRANGE commands, so the time
+        it takes doesn't grow with the network latency times the number of queues. Each command of the pipeline is
+        short, so redis serves other clients (e.g. the Memory Engine flushing) in between.
+        :param venues: list of venue names
+        :param cylinder_labels: the labels of the cylinders to read. If None, the keys of each venue are looked
+        up in the key registry first - one more round trip.
+        :return: dikt with keys the venues and values dikts like the ones returned by get_queues_for_venue()
+        """
+        if cylinder_labels is None:
+            self.migrate_key_registry()
+            pipe = self.r.pipeline(transaction=False)
+            for venue in venues:
+                pipe.smembers(venue_registry_key(venue))
+            keys_of_venues = [sorted(keys) for keys in pipe.execute()]
+        else:
+            keys_of_venues = [[key(venue, cyl_label) for cyl_label in cylinder_labels] for venue in venues]
+
+        pipe = self.raw.pipeline(transaction=False)
+        for keys in keys_of_venues:
+            for k in keys:
+                pipe.lrange(k, 0, -1)
+        queues = iter(pipe.execute())
+
+        result = {}
+        for venue, keys in zip(venues, keys_of_venues):
+            result[venue] = {}
+            for k, queue in zip(keys, queues):
+                # redis deletes a queue when its last element is dequeued, so an empty queue doesn't exist
+                if queue:
+                    result[venue][k] = self._snapshots(queue)
         return result
 
     def get_size_of_cylinder_queue(self, venue, cylinder):
@@ -124,10 +196,76 @@ class TrainingDataRedisAdapter(RedisAdapter):
         :param cylinder: str
         :return: list
         """
-        queue_name = key(venue, cylinder)
-        queue_len = self.r.llen(queue_name)
-        queue_data = self.r.lrange(queue_name, 0, queue_len)
-        return queue_data
+        queue_data = self.raw.lrange(key(venue, cylinder), 0, -1)
+        return self._snapshots(queue_data)
+
+    def _snapshots(self, entries):
+        """
+        :param entries: the entries of a queue, as read with self.raw.lrange()
+        :return: list with the full snapshot of each entry
+        """
+        snapshots = reconstruct_snapshots([self.codec.decode(entry) for entry in entries])
+        return snapshots if self.decode_responses else [snapshot.encode('utf-8') for snapshot in snapshots]
+
+    def _enqueue_snapshot_deltas(self, pipe, venue, cylinders_dikt):
+        """
+        The delta_snapshots version of atomic_cylinders_enqueue(). Runs in a transaction, which watches the queues.
+        :return: list with the new length of the queue of each cylinder
+        :raises RuntimeError - if the queues have different lengths
+        """
+        entries = {}
+        lengths = [pipe.llen(key(venue, cyl_label)) for cyl_label in cylinders_dikt]
+        if len(set(lengths)) > 1:
+            raise _lengths_differ_error(venue, list(cylinders_dikt),
+                                        "queue lengths differ: %s" % ", ".join(str(length) for length in lengths))
+        for cyl_label, cyl_data in cylinders_dikt.items():
+            queue_name = key(venue, cyl_label)
+            entry = None
+            # the two oldest entries stay full, so that a dequeue never removes the base of the oldest entry
+            if lengths[0] >= 2:
+                newest_entries = [self.codec.decode(e) for e in pipe.lrange(queue_name, 0, self.keyframe_interval - 2)]
+                previous = newest_snapshot(newest_entries, self.keyframe_interval)
+                if previous is not None:
+                    entry = make_delta_entry(previous, cyl_data)
+            entries[queue_name] = entry or cyl_data
+
+        pipe.multi()
+        for queue_name, entry in entries.items():
+            self.enqueue(pipe)(queue_name, self.encode_value(entry))
+        self.register_keys(pipe, venue, *entries.keys())
+        return [length + 1 for length in lengths]
+
+    def _dequeue_snapshots(self, pipe, queue_names):
+        """
+        The delta_snapshots version of a non-blocking dequeue. Runs in a transaction, which watches the queues.
+        Dequeues the oldest snapshot of each queue and replaces the deltas among the next two oldest entries with
+        full snapshots.
+        :return: list with the dequeued snapshot (or None) for each of :queue_names
+        """
+        tails = [[self.codec.decode(entry) for entry in pipe.lrange(queue_name, -3, -1)] for queue_name in queue_names]
+        pipe.multi()
+        result = []
+        for queue_name, tail in zip(queue_names, tails):
+            snapshots = reconstruct_snapshots(tail)
+            self.non_blocking_dequeue(pipe)(queue_name)
+            # after the dequeue tail[-2] is the oldest entry (-1), tail[-3] the one before it (-2)
+            for index, entry, snapshot in zip([-2, -1][-len(tail[:-1]):], tail[:-1], snapshots[:-1]):
+                if is_delta(entry):
+                    pipe.lset(queue_name, index, self.encode_value(snapshot))
+            result.append(self._snapshots(tail[-1:])[0] if tail else None)
+        return result
+
+    def _restore_full_snapshots(self, pipe, queue_name):
+        """
+        Replace the deltas among the two oldest entries of the queue with full snapshots.
+        Runs in a transaction, which watches the queue.
+        """
+        tail = [self.codec.decode(entry) for entry in pipe.lrange(queue_name, -2, -1)]
+        snapshots = reconstruct_snapshots(tail)
+        pipe.multi()
+        for index, entry, snapshot in zip([-2, -1][-len(tail):], tail, snapshots):
+            if is_delta(entry):
+                pipe.lset(queue_name, index, self.encode_value(snapshot))
 
     def redis_is_up(self, ):
         try:
@@ -135,21 +273,19 @@ class TrainingDataRedisAdapter(RedisAdapter):
         except:
             return False
 
-    def drop_db(self):
-        """
-        Deletes ALL keys of the current database
-        :return:
-        """
-        keys = self.r.keys("*")
-        if keys:
-            self.r.delete(*keys)
-
     def get_venue_labels(self, venue):
         """
         Return the names of all Labels used as keys for this venue
         :param venue: venue name
         :return: array of strings of the names of labels
         """
-        venue_keys = self.r.keys(
-            key(venue, '') + "*")  ## gets all keys that have in the beginning the name of the venue
+        venue_keys = self.get_keys_of_venue(venue)
         return [get_non_venue_part_of_key(k) for k in venue_keys]  # return only the label
+
+
+def _lengths_differ_error(venue, cyl_labels, error):
+    return RuntimeError("The length of the queues for [{venue}] differ. {error}. keys:[{keys}]".format(
+        venue=venue,
+        error=error,
+        keys=cyl_labels
+    ))
@@ -2,6 +2,12 @@ from os import environ
 
 key_separator = "____"
 redis_wildcard_sym = "*"
+# a set with the names of all venues which have keys
+venues_key = "__venues__"
+# prefix of the sets with the keys of each venue, see venue_registry_key()
+venue_registry_prefix = "__venue_keys__"
+# exists once the keys created before the key registry existed are registered, see RedisAdapter.migrate_key_registry()
+registry_migrated_key = "__venue_keys_migrated__"
 
 
 def key(*args, **kwargs):
@@ -48,6 +54,17 @@ def venue_wildcard_key(venue):
     return key(venue, redis_wildcard_sym)
 
 
+def venue_registry_key(venue):
+    """
+    :return: the key of the set with all keys of :venue, e.g. "__venue_keys______agora"
+    """
+    return key(venue_registry_prefix, venue)
+
+
+def is_registry_key(k):
+    return k in (venues_key, registry_migrated_key) or k.startswith(venue_registry_prefix + key_separator)
+
+
 def configure_redis_for_testing():
     # use a different namespace when testing
 